@@ -5,7 +5,7 @@
 from django.utils.translation import gettext_lazy as _
 from django.utils.safestring import mark_safe
 from django.urls import reverse_lazy
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin.models import LogEntry
 from django.db.models import Q
 from reshuffle.settings import PROJECT_NAME
@@ -28,6 +28,19 @@ class AdministrationEntry(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False
 
+    def delete_with_objects(self, request, qs, field: str):
+        # delete objects of all entries at once, entries with objects, which were not deleted, are kept & reported
+        errors = MinioClient.shared().delete_objects(qs.values_list(field, flat=True))
+        qs.exclude(**{f"{field}__in": errors.keys()}).delete()
+        if errors:
+            self.message_user(
+                request,
+                _("Some objects cannot be deleted from object storage, the entries are kept: %(errors)s") % {
+                    "errors": "; ".join(e for v in errors.values() for e in v[:3])
+                },
+                messages.ERROR
+            )
+
 
 def get_accesses(groups):
     accesses = []
@@ -295,10 +308,46 @@ class ObjectStorageEntryAdmin(AdministrationEntry):
     download_button.short_description = _("Download")
 
     def delete_queryset(self, request, qs):
-        mc = MinioClient()
-        for obj in qs:
-            mc.delete_object(obj.prefix)
-        qs.delete()
+        self.delete_with_objects(request, qs, "prefix")
+
+
+@admin.register(UniqueKeyEntry)
+class UniqueKeyEntryAdmin(AdministrationEntry):
+    list_display = ("id", "unique_key", "archive", "variant", "created",)
+    list_display_links = ("id",)
+    date_hierarchy = "created"
+    ordering = ("-created",)
+    list_filter = (("archive", admin.RelatedOnlyFieldListFilter),)
+    search_fields = ("unique_key",)
+    search_help_text = _("The search is performed by unique key")
+
+
+@admin.register(PackJob)
+class PackJobAdmin(AdministrationEntry):
+    list_display = ("id", "subject", "date", "amount", "username", "status", "created", "updated",)
+    list_display_links = ("id",)
+    date_hierarchy = "created"
+    ordering = ("-created",)
+    list_filter = ("status", ("subject", admin.RelatedOnlyFieldListFilter), ("user", admin.RelatedOnlyFieldListFilter),)
+
+    def username(self, obj: "PackJob"):
+        return obj.user.get_full_name() if obj.user.get_full_name() else obj.user.username
+
+    username.short_description = PackJob._meta.get_field("user").verbose_name
+
+
+@admin.register(IngestJob)
+class IngestJobAdmin(AdministrationEntry):
+    list_display = ("id", "prefix", "username", "status", "created", "updated",)
+    list_display_links = ("id",)
+    date_hierarchy = "created"
+    ordering = ("-created",)
+    list_filter = ("status", ("user", admin.RelatedOnlyFieldListFilter),)
+
+    def username(self, obj: "IngestJob"):
+        return obj.user.get_full_name() if obj.user.get_full_name() else obj.user.username
+
+    username.short_description = IngestJob._meta.get_field("user").verbose_name
 
 
 @admin.register(VerifiedWorkEntry)
@@ -317,10 +366,7 @@ class VerifiedWorkEntryAdmin(AdministrationEntry):
     username.short_description = VerifiedWorkEntry._meta.get_field("user").verbose_name
 
     def delete_queryset(self, request, qs):
-        mc = MinioClient()
-        for obj in qs:
-            mc.delete_object(obj.alias)
-        qs.delete()
+        self.delete_with_objects(request, qs, "alias")
 
     class Media:
         js = ("admin/js/model_verified_work_entry_modification.js",)
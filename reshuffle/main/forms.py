@@ -37,7 +37,7 @@ class AuthForm(AuthenticationForm):
 
 class CreationForm(forms.Form):
     __MIN = 1
-    __MAX = 100
+    __MAX = 5000
 
     def __init__(self, subject_choices, *args, **kwargs):
         super(CreationForm, self).__init__(*args, **kwargs)
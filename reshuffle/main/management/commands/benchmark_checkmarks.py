@@ -0,0 +1,46 @@
+from time import perf_counter
+import numpy as np
+import cv2
+from django.core.management.base import BaseCommand
+from main.services.ocr.analyzer import Analyzer
+
+
+class Command(BaseCommand):
+    help = "Compare the per-box & the batch fill detection of the checkboxes on scanned sheets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", nargs="+", help="Images of the sheets")
+        parser.add_argument("--repeat", type=int, default=10, help="Repetitions of the timing")
+        parser.add_argument("--tolerance", type=float, default=0.02, help="Allowed difference of the fill ratios")
+
+    def handle(self, *args, **options):
+        analyzer = Analyzer()
+        total_single = total_batch = 0
+        for path in options["images"]:
+            img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                self.stderr.write(f"{path}: image cannot be decoded")
+                continue
+            # the same preprocessing as the verification of works
+            img = analyzer.threshold(analyzer.restore_perspective(analyzer.grayscale(img)))
+            boxes = analyzer.filter_checkboxes(analyzer.calc_stats(img))
+            start = perf_counter()
+            for _ in range(options["repeat"]):
+                single = np.array([analyzer.fill_ratio(img, box) for box in boxes])
+            elapsed_single = (perf_counter() - start) / options["repeat"]
+            start = perf_counter()
+            for _ in range(options["repeat"]):
+                batch = analyzer.fill_ratios(img, boxes)
+            elapsed_batch = (perf_counter() - start) / options["repeat"]
+            marks = np.array([analyzer.check_mark(img, box) for box in boxes], dtype=bool)
+            total_single += elapsed_single
+            total_batch += elapsed_batch
+            difference = np.abs(single - batch)
+            self.stdout.write(
+                f"{path}: {len(boxes)} box(es), per-box {elapsed_single * 1000:.2f} ms, "
+                f"batch {elapsed_batch * 1000:.2f} ms, max difference {difference.max(initial=0):.4f}, "
+                f"outside tolerance {int((difference > options['tolerance']).sum())}, "
+                f"different marks {int((analyzer.check_marks(img, boxes) != marks).sum())}"
+            )
+        if total_batch:
+            self.stdout.write(f"Speedup: {total_single / total_batch:.1f}x")
@@ -0,0 +1,83 @@
+from time import perf_counter
+import numpy as np
+from django.core.management.base import BaseCommand
+from reshuffle.settings import GLYPH_MODEL
+from main.services.docs.factory import UniqueKey
+from main.services.ocr.analyzer import Analyzer
+from main.services.ocr.glyphs import GlyphClassifier, load_samples, segment_glyphs
+
+
+class Command(BaseCommand):
+    help = "Compare speed & accuracy of the glyph classifier & EasyOCR on labelled fields: <path>/<text>/<image>"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Folder of the labelled crops of fields (not used for training)")
+        parser.add_argument(
+            "--field",
+            choices=["key", "correction"],
+            default="key",
+            help="key: boxes of unique keys, correction: correction fields (cells side by side, 1px margins)"
+        )
+        parser.add_argument("--cells", type=int, default=4, help="Cells of the correction field")
+        parser.add_argument("--model", default=GLYPH_MODEL, help="Model file (GLYPH_MODEL by default)")
+        parser.add_argument("--skip-easyocr", action="store_true", help="Benchmark the glyph classifier only")
+
+    def handle(self, *args, **options):
+        classifier = GlyphClassifier()
+        classifier.load(options["model"])
+        analyzer = Analyzer(glyphs=classifier)
+        imgs, labels = load_samples(options["path"])
+        if not imgs:
+            self.stderr.write("No samples")
+            return
+        key = options["field"] == "key"
+        allowlist = UniqueKey.BASE if key else analyzer.correction_allowlist()
+        # glyph classifier (the same calls as the analyzer: one call per field, None if any glyph isn't confident)
+        start = perf_counter()
+        if key:
+            glyphs = [analyzer.read_glyphs(segment_glyphs(img), allowlist) for img in imgs]
+        else:
+            glyphs = [analyzer.read_glyphs(self.__cells(img, options["cells"]), allowlist) for img in imgs]
+        elapsed_glyphs = perf_counter() - start
+        accepted = [(text, label) for text, label in zip(glyphs, labels) if text is not None]
+        self.__report("Glyph classifier", elapsed_glyphs, len(imgs), sum(t == label for t, label in accepted))
+        self.stdout.write(
+            f"    accepted: {len(accepted) / len(imgs):.1%}, "
+            f"accuracy of accepted: {sum(t == label for t, label in accepted) / max(1, len(accepted)):.1%}"
+        )
+        if options["skip_easyocr"]:
+            return
+        # EasyOCR (the same calls as the analyzer: readtext of the key box, one recognize_batch of the sheet)
+        self.__easyocr(analyzer, imgs[:1], allowlist, key)  # load the models
+        start = perf_counter()
+        texts = self.__easyocr(analyzer, imgs, allowlist, key)
+        elapsed = perf_counter() - start
+        self.__report("EasyOCR", elapsed, len(imgs), sum(t == label for t, label in zip(texts, labels)))
+        # analyzer: fields which aren't accepted by the glyph classifier are read by EasyOCR
+        fallback = [i for i, text in enumerate(glyphs) if text is None]
+        start = perf_counter()
+        texts = self.__easyocr(analyzer, [imgs[i] for i in fallback], allowlist, key)
+        elapsed = elapsed_glyphs + perf_counter() - start
+        for i, text in zip(fallback, texts):
+            glyphs[i] = text
+        self.__report("Analyzer", elapsed, len(imgs), sum(t == label for t, label in zip(glyphs, labels)))
+
+    @staticmethod
+    def __cells(img: np.ndarray, n: int) -> list[np.ndarray]:
+        # cells of the correction field without the margins
+        return [cell[1:-1, 1:-1] for cell in np.array_split(img, n, axis=1)]
+
+    @staticmethod
+    def __easyocr(analyzer: Analyzer, imgs: list[np.ndarray], allowlist: str, key: bool) -> list[str]:
+        if key:
+            # (!) the printed key is the last word of the box
+            texts = [
+                analyzer.recognize(img, (0, 0, img.shape[1], img.shape[0], 0), allowlist=allowlist) for img in imgs
+            ]
+            return [text.split(" ")[-1].strip() for text in texts]
+        return analyzer.recognize_batch(imgs, [allowlist] * len(imgs))
+
+    def __report(self, name: str, elapsed: float, count: int, correct: int) -> None:
+        self.stdout.write(
+            f"{name}: {elapsed * 1000 / count:.3f} ms/field, accuracy: {correct / count:.1%} ({correct} / {count})"
+        )
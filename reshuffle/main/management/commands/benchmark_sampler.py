@@ -0,0 +1,48 @@
+from random import choice, shuffle
+from time import perf_counter
+import numpy as np
+from django.core.management.base import BaseCommand
+from main.services.docs.sampler import DifficultySampler
+
+
+def random_walk(task_count: int, total: int, difficulties: list[int]) -> list[int]:
+    # difficulty distribution by the random-walk loop used before the sampler (reference only)
+    distribution = [choice(difficulties) for _ in range(task_count)]
+    while sum(distribution) != total:
+        if sum(distribution) > total:
+            i = distribution.index(choice(list(set(difficulties[1:]) & set(distribution))))
+            distribution[i] -= 1
+        else:
+            i = distribution.index(choice(list(set(difficulties[:-1]) & set(distribution))))
+            distribution[i] += 1
+    shuffle(distribution)
+    return distribution
+
+
+class Command(BaseCommand):
+    help = "Compare the constructive difficulty sampler & the random-walk loop used before"
+
+    CASES = [(10, 10), (15, 2), (15, 28), (30, 30), (40, 1), (40, 79), (60, 60), (60, 119)]  # (tasks, total)
+
+    def add_arguments(self, parser):
+        parser.add_argument("--variants", type=int, default=1000, help="Distributions sampled for every case")
+
+    def handle(self, *args, **options):
+        difficulties = [0, 1, 2]
+        variants = options["variants"]
+        sampler = DifficultySampler(difficulties)
+        generator = np.random.default_rng()
+        self.stdout.write(f"{'tasks':>6} {'total':>6} {'random walk (ms)':>18} {'sampler (ms)':>14} {'speedup':>9}")
+        for n, s in self.CASES:
+            start = perf_counter()
+            for _ in range(variants):
+                random_walk(n, s, difficulties)
+            elapsed_walk = perf_counter() - start
+            start = perf_counter()
+            sample = sampler.sample(n, s, variants, generator)
+            elapsed = perf_counter() - start
+            if not ((sample.sum(axis=1) == s).all() and sample.min() >= 0 and sample.max() <= 2):
+                self.stderr.write(f"Invalid sample: {n} task(s), total {s}")
+            self.stdout.write(
+                f"{n:>6} {s:>6} {elapsed_walk * 1000:>18.1f} {elapsed * 1000:>14.1f} {elapsed_walk / elapsed:>8.1f}x"
+            )
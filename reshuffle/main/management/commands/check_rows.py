@@ -0,0 +1,47 @@
+import json
+from time import perf_counter
+import numpy as np
+import cv2
+from django.core.management.base import BaseCommand
+from main.services.ocr.analyzer import Analyzer
+from main.services.ocr.rows import legacy_rows
+
+
+class Command(BaseCommand):
+    help = "Check that the rows of the checkboxes are the same as by the previous algorithm (images or recognitions)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Images of the sheets or stored recognitions (.json)")
+
+    def handle(self, *args, **options):
+        analyzer = Analyzer()
+        different = 0
+        elapsed_legacy = elapsed = 0
+        for path in options["paths"]:
+            if path.endswith(".json"):
+                with open(path, encoding="UTF-8") as f:
+                    stats = np.array(json.load(f)["stats"], dtype=np.int32)
+            else:
+                img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    self.stderr.write(f"{path}: image cannot be decoded")
+                    continue
+                # the same preprocessing as the verification of works
+                stats = analyzer.calc_stats(
+                    analyzer.threshold(analyzer.restore_perspective(analyzer.grayscale(img)))
+                )
+            stats = analyzer.filter_checkboxes(stats)
+            tolerance = analyzer.row_tolerance(stats)
+            start = perf_counter()
+            expected = legacy_rows(stats, tolerance)
+            elapsed_legacy += perf_counter() - start
+            start = perf_counter()
+            rows = analyzer.cluster_rows(stats, tolerance)
+            elapsed += perf_counter() - start
+            same = len(rows) == len(expected) and all(np.array_equal(a, b) for a, b in zip(rows, expected))
+            different += not same
+            self.stdout.write(f"{path}: {len(rows)} row(s), {'same' if same else 'DIFFERENT'}")
+        self.stdout.write(
+            f"Different: {different} / {len(options['paths'])}, "
+            f"previous {elapsed_legacy * 1000:.2f} ms, single-pass {elapsed * 1000:.2f} ms"
+        )
@@ -0,0 +1,25 @@
+import json
+from django.core.management.base import BaseCommand
+from main.models import ObjectStorageEntry, UniqueKeyEntry
+from main.services.docs.minio_client import MinioClient
+from main.services.docs.archive import ArchiveData
+from main.services.docs.factory import GeneratorJSON
+
+
+class Command(BaseCommand):
+    help = "Add the unique keys of archives created before the index existed to the unique key index"
+
+    def handle(self, *args, **options):
+        mc = MinioClient.shared()
+        for archive in ObjectStorageEntry.objects.exclude(
+                id__in=UniqueKeyEntry.objects.filter(archive__isnull=False).values("archive")
+        ):
+            data = ArchiveData(json.loads(mc.get_object_content(f"{archive.prefix}/{GeneratorJSON.OUTPUT_JSON}")))
+            UniqueKeyEntry.objects.bulk_create(
+                [UniqueKeyEntry(unique_key=k, archive=archive, variant=i) for i, k in enumerate(data.unique_keys())],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+            # (!) objects returned by bulk_create with ignore_conflicts include the skipped ones, so rows are counted
+            added = UniqueKeyEntry.objects.filter(archive=archive).count()
+            self.stdout.write(f"{archive.prefix}: {added} / {len(data)} key(s) (the rest are issued by other archives)")
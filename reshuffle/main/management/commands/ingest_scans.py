@@ -0,0 +1,30 @@
+import json
+from django.core.management.base import BaseCommand
+from reshuffle.settings import INGEST_WORKERS
+from main.services.ocr.ingest import ingest_works
+
+
+class Command(BaseCommand):
+    help = "Recognize & store a batch of scanned works (ZIP archive of images or multi-page PDF)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="ZIP archive or PDF file")
+        parser.add_argument("--prefix", default=None, help="Archive of the works (resolved by unique keys if omitted)")
+        parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Pages processed at once")
+        parser.add_argument("--output", default=None, help="Write the manifest of the pages (JSON) to the file")
+
+    def handle(self, *args, **options):
+        pages = ingest_works(options["path"], options["prefix"], options["workers"])
+        for page in pages:
+            if page["recognized"]:
+                state = page["unique_key"]
+            elif page["stored"]:
+                state = f"unrecognized (stored as {page['alias']})"
+            else:
+                state = page.get("error", "unrecognized")
+            duplicate = f" (duplicate, kept: {page['kept']})" if page["duplicate"] else ""
+            self.stdout.write(f"{page['page']}: {state}{duplicate}")
+        self.stdout.write(f"Recognized: {sum(p['recognized'] for p in pages)} / {len(pages)}")
+        if options["output"]:
+            with open(options["output"], "w", encoding="UTF-8") as f:
+                json.dump(pages, f, ensure_ascii=False, indent=4)
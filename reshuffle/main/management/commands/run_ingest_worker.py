@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from main.services.ocr.worker import IngestWorker
+
+
+class Command(BaseCommand):
+    help = "Run a worker process that recognizes queued batches of scans outside the request cycle"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=IngestWorker.POLL_INTERVAL, help="Poll interval (s)")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ingest worker started")
+        IngestWorker(poll_interval=options["interval"]).run(once=options["once"])
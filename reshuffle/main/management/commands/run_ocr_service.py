@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from reshuffle.settings import OCR_SOCKET, OCR_BATCH_SIZE, OCR_BATCH_WAIT
+from main.services.ocr.service import OCRService
+
+
+class Command(BaseCommand):
+    help = "Run the OCR service process, which owns the recognition models & serves the web workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=OCR_SOCKET, help="Unix socket path (OCR_SOCKET by default)")
+        parser.add_argument("--batch-size", type=int, default=OCR_BATCH_SIZE, help="Max images of one batch")
+        parser.add_argument("--batch-wait", type=float, default=OCR_BATCH_WAIT, help="Max wait for a batch (s)")
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            self.stderr.write("The socket path is not specified (OCR_SOCKET or --socket)")
+            return
+        self.stdout.write(f"OCR service started: {options['socket']}")
+        OCRService(options["socket"], options["batch_size"], options["batch_wait"]).serve()
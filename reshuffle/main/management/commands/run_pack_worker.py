@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from main.services.docs.worker import PackWorker
+
+
+class Command(BaseCommand):
+    help = "Run a worker process that builds queued archives outside the request cycle"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=PackWorker.POLL_INTERVAL, help="Poll interval (s)")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Pack worker started")
+        PackWorker(poll_interval=options["interval"]).run(once=options["once"])
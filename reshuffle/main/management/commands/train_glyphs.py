@@ -0,0 +1,24 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from reshuffle.settings import GLYPH_MODEL
+from main.services.ocr.glyphs import GlyphClassifier, load_samples
+
+
+class Command(BaseCommand):
+    help = "Train the glyph classifier (unique keys & correction fields) on labelled crops: <path>/<label>/<image>"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Folder of the labelled crops")
+        parser.add_argument("--output", default=GLYPH_MODEL, help="Model file (GLYPH_MODEL by default)")
+        parser.add_argument("--append", action="store_true", help="Add the samples to the existing model")
+
+    def handle(self, *args, **options):
+        classifier = GlyphClassifier()
+        if options["append"]:
+            classifier.load(options["output"])
+        imgs, labels = load_samples(options["path"])
+        added = classifier.train(imgs, labels)
+        for label, count in sorted(Counter(labels).items()):
+            self.stdout.write(f"{label}: {count}")
+        classifier.save(options["output"])
+        self.stdout.write(f"Samples: {added} / {len(imgs)} (empty crops are skipped), model: {len(classifier)}")
@@ -321,8 +321,7 @@ class ObjectStorageEntry(AbstractDatestamp):
     )
 
     def delete(self, *args, **kwargs):
-        mc = MinioClient()
-        mc.delete_object(self.prefix)
+        MinioClient.shared().delete_object(self.prefix)
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -334,6 +333,214 @@ class ObjectStorageEntry(AbstractDatestamp):
         verbose_name_plural = _("Object storage entries")
 
 
+class UniqueKeyEntry(AbstractDatestamp):
+    UK_LENGTH = 8
+
+    unique_key = models.CharField(
+        max_length=UK_LENGTH,
+        unique=True,
+        help_text=_("Unique key issued for the variant"),
+        verbose_name=_("Unique key")
+    )
+    archive = models.ForeignKey(
+        ObjectStorageEntry,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text=_("Archive to which the variant relates (empty while the archive is being created)"),
+        verbose_name=_("Object storage entry")
+    )
+    variant = models.PositiveIntegerField(
+        help_text=_("Position of the variant in the archive"),
+        verbose_name=_("Variant")
+    )
+
+    @staticmethod
+    def lookup(unique_key: str) -> "UniqueKeyEntry | None":
+        # resolve the unique key to its archive (one query by the unique index)
+        return UniqueKeyEntry.objects.select_related("archive").filter(
+            unique_key=unique_key,
+            archive__isnull=False
+        ).first()
+
+    def __str__(self):
+        return f"ID: {self.id}, {self.unique_key}, {self.archive.prefix if self.archive else None}"
+
+    class Meta:
+        app_label = "admin"
+        verbose_name = _("Unique key entry")
+        verbose_name_plural = _("Unique key entries")
+
+
+class PackJob(AbstractDatestamp):
+    STATUSES = {
+        0: _("Queued"),
+        1: _("Running"),
+        2: _("Done"),
+        3: _("Failed"),
+    }
+    STAGES = {
+        "json": _("Data"),
+        "upload": _("Upload"),
+        "xlsx": _("Answer sheets"),
+        "pdf": _("Tasks & answers"),
+        "archive": _("Archive"),
+    }
+    STAGE_STATES = ["pending", "running", "done", "failed"]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        help_text=_("User who requested the archive"),
+        verbose_name=_("Creator")
+    )
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        help_text=_("Subject for which the archive is created"),
+        verbose_name=_("Subject")
+    )
+    amount = models.PositiveSmallIntegerField(
+        help_text=_("Amount of unique variants in the archive"),
+        verbose_name=_("Amount")
+    )
+    date = models.DateField(
+        help_text=_("Date of the exam for which the archive is created"),
+        verbose_name=_("Exam date")
+    )
+    status = models.PositiveSmallIntegerField(
+        choices=STATUSES,
+        default=0,
+        db_index=True,
+        help_text=_("Current state of the job"),
+        verbose_name=_("Status")
+    )
+    progress = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text=_("State of every stage of the job"),
+        verbose_name=_("Progress")
+    )
+    archive = models.ForeignKey(
+        ObjectStorageEntry,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        help_text=_("Archive created by the job"),
+        verbose_name=_("Object storage entry")
+    )
+    error = models.TextField(
+        blank=True,
+        help_text=_("Reason why the job failed"),
+        verbose_name=_("Error")
+    )
+    stats = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text=_("Statistics of the stages of the job (e.g. hit ratio of the caches)"),
+        verbose_name=_("Statistics")
+    )
+
+    def set_stage(self, stage: str, state: str) -> None:
+        self.progress[stage] = state
+        self.save(update_fields=["progress", "updated"])
+
+    def stages(self) -> list[dict]:
+        return [
+            {"name": k, "title": str(v), "state": self.progress.get(k, PackJob.STAGE_STATES[0])}
+            for k, v in PackJob.STAGES.items()
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "status_title": str(PackJob.STATUSES[self.status]),
+            "stages": self.stages(),
+            "prefix": self.archive.prefix if self.archive else None,
+            "error": self.error if self.error else None
+        }
+
+    def __str__(self):
+        return f"ID: {self.id}, {self.subject}, {self.amount}, {self.date}"
+
+    class Meta:
+        app_label = "admin"
+        verbose_name = _("Pack job")
+        verbose_name_plural = _("Pack jobs")
+
+
+class IngestJob(AbstractDatestamp):
+    STATUSES = PackJob.STATUSES
+    PATH_LENGTH = 256
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        help_text=_("User who uploaded the batch of scans"),
+        verbose_name=_("Creator")
+    )
+    prefix = models.CharField(
+        max_length=ObjectStorageEntry.STR_LENGTH,
+        blank=True,
+        help_text=_("Archive of the works (empty: resolved by the unique keys)"),
+        verbose_name=_("Prefix")
+    )
+    path = models.CharField(
+        max_length=PATH_LENGTH,
+        help_text=_("Uploaded file (ZIP archive of images or multi-page PDF) waiting for the worker"),
+        verbose_name=_("File")
+    )
+    status = models.PositiveSmallIntegerField(
+        choices=STATUSES,
+        default=0,
+        db_index=True,
+        help_text=_("Current state of the job"),
+        verbose_name=_("Status")
+    )
+    progress = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text=_("Processed & total pages of the batch"),
+        verbose_name=_("Progress")
+    )
+    manifest = models.JSONField(
+        default=list,
+        blank=True,
+        help_text=_("Result of every page of the batch"),
+        verbose_name=_("Manifest")
+    )
+    error = models.TextField(
+        blank=True,
+        help_text=_("Reason why the job failed"),
+        verbose_name=_("Error")
+    )
+
+    def set_progress(self, done: int, total: int) -> None:
+        self.progress = {"done": done, "total": total}
+        self.save(update_fields=["progress", "updated"])
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "status_title": str(IngestJob.STATUSES[self.status]),
+            "done": self.progress.get("done", 0),
+            "total": self.progress.get("total"),
+            "pages": self.manifest if self.status == 2 else None,
+            "recognized": sum(p["recognized"] for p in self.manifest) if self.status == 2 else None,
+            "error": self.error if self.error else None
+        }
+
+    def __str__(self):
+        return f"ID: {self.id}, {self.prefix if self.prefix else '-'}, {self.user}"
+
+    class Meta:
+        app_label = "admin"
+        verbose_name = _("Ingest job")
+        verbose_name_plural = _("Ingest jobs")
+
+
 class VerifiedWorkEntry(AbstractDatestamp):
     UK_LENGTH = 8
     ALIAS_LENGTH = 128
@@ -366,8 +573,7 @@ class VerifiedWorkEntry(AbstractDatestamp):
     )
 
     def delete(self, *args, **kwargs):
-        mc = MinioClient()
-        mc.delete_object(self.alias)
+        MinioClient.shared().delete_object(self.alias)
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -0,0 +1,193 @@
+import json
+from copy import deepcopy
+from threading import Lock
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+
+class ArchiveData:
+    """
+    ...
+    """
+
+    VERSION = 2  # 1: every variant contains full content of its tasks & options, 2: content is stored once by ID
+    LAYOUT_SINGLE = "single"  # tasks & answers of all variants in one document each
+    LAYOUT_SPLIT = "split"  # tasks & answers of every variant in separate documents & the index page
+    LAYOUTS = (LAYOUT_SINGLE, LAYOUT_SPLIT)
+
+    def __init__(self, data: dict) -> None:
+        self.__data = data
+        self.version = data.get("version", 1)
+        self.layout = data.get("layout", self.LAYOUT_SINGLE)
+        self.__positions = {v["unique_key"]: i for i, v in enumerate(data["variants"])}
+
+    @property
+    def raw(self) -> dict:
+        return self.__data
+
+    @property
+    def subject(self) -> dict:
+        return self.__data["subject"]
+
+    @property
+    def date(self) -> str:
+        return self.__data["date"]
+
+    @property
+    def doc_header(self) -> str:
+        return self.__data["doc_header"]
+
+    def unique_keys(self) -> list[str]:
+        return list(self.__positions.keys())
+
+    def parts(self) -> list[dict]:
+        # info of parts without content of the tasks (the same for all variants of the archive)
+        if self.version == 1:
+            infos = [deepcopy(p["info"]) for p in self.__data["variants"][0]["parts"]]
+        else:
+            infos = [self.__part_info(p["id"]) for p in self.__data["variants"][0]["parts"]]
+        for info in infos:
+            info.pop("difficulty_generated")
+        return infos
+
+    def variant(self, unique_key: str) -> dict | None:
+        # return a new dict of the variant in the expanded form (version 1), so it can be modified by the caller
+        if unique_key not in self.__positions:
+            return None
+        variant = self.__data["variants"][self.__positions[unique_key]]
+        if self.version == 1:
+            return deepcopy(variant)
+        return self.__expand(variant)
+
+    def manifest(self) -> dict:
+        # compact list of the unique keys, stored next to the per-variant objects
+        return {"unique_keys": self.unique_keys()}
+
+    def context(self) -> dict:
+        # context for the templates of documents
+        return {
+            "subject": self.subject,
+            "date": self.date,
+            "doc_header": self.doc_header,
+            "variants": self
+        }
+
+    def __part_info(self, part_id: int) -> dict:
+        info = self.__data["parts"][str(part_id)]
+        return {
+            "id": info["id"],
+            "title": info["title"],
+            "answer_type": info["answer_type"],
+            "task_count": info["task_count"],
+            "difficulty_total": info["difficulty_total"],
+            "difficulty_generated": 0,
+            "inst_content": info["inst_content"]
+        }
+
+    def __expand(self, variant: dict) -> dict:
+        tasks = self.__data["tasks"]
+        options = self.__data["options"]
+        parts = []
+        for part in variant["parts"]:
+            info = self.__part_info(part["id"])
+            material = []
+            for position, task_id, option_ids in part["material"]:
+                task = tasks[str(task_id)]
+                info["difficulty_generated"] += task["difficulty"]
+                material.append({
+                    "id": task_id,
+                    "position": f"{info['title']}{position}",
+                    "difficulty": task["difficulty"],
+                    "content": task["content"],
+                    "updated": task.get("updated"),
+                    "options": [{
+                        "id": o,
+                        "content": options[str(o)]["content"],
+                        "is_answer": options[str(o)]["is_answer"],
+                        "updated": options[str(o)].get("updated")
+                    } for o in option_ids]
+                })
+            parts.append({"info": info, "material": material})
+        return {"unique_key": variant["unique_key"], "parts": parts}
+
+    def __contains__(self, unique_key: str) -> bool:
+        return unique_key in self.__positions
+
+    def __len__(self) -> int:
+        return len(self.__data["variants"])
+
+    def __iter__(self) -> Iterator[dict]:
+        # variants are expanded lazily (one at a time) on every iteration
+        for variant in self.__data["variants"]:
+            yield variant if self.version == 1 else self.__expand(variant)
+
+
+class ArchiveManifest:
+    """
+    ...
+    """
+
+    def __init__(self, data: dict) -> None:
+        self.__unique_keys = data["unique_keys"]
+        self.__index = set(self.__unique_keys)
+
+    def unique_keys(self) -> list[str]:
+        return list(self.__unique_keys)
+
+    def __contains__(self, unique_key: str) -> bool:
+        return unique_key in self.__index
+
+    def __len__(self) -> int:
+        return len(self.__unique_keys)
+
+
+class ArchiveCache:
+    """
+    ...
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.__max_size = max_size  # total size of the cached JSON files (bytes)
+        self.__size = 0
+        self.__entries = OrderedDict()  # alias -> (etag, size, parsed object), least recently used first
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, client, alias: str, parse: Callable[[dict], object] = ArchiveData) -> object:
+        # revalidate the cached entry with the current ETag of the object (one HEAD request instead of GET)
+        etag = client.get_object_stats(alias).etag
+        with self.__lock:
+            entry = self.__entries.get(alias)
+            if entry and entry[0] == etag:
+                self.__entries.move_to_end(alias)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        # download & parse the object outside the lock (ETag of the downloaded version is taken from the response)
+        response = client.get_object_content(alias, decoded=False)
+        try:
+            content = response.data
+            etag = response.headers.get("ETag", etag).strip('"')
+        finally:
+            response.close()
+            response.release_conn()
+        data = parse(json.loads(content))
+        with self.__lock:
+            self.__put(alias, etag, len(content), data)
+        return data
+
+    def __put(self, alias: str, etag: str, size: int, data: ArchiveData) -> None:
+        if alias in self.__entries:
+            self.__size -= self.__entries.pop(alias)[1]
+        if size > self.__max_size:
+            return
+        self.__entries[alias] = (etag, size, data)
+        self.__size += size
+        # evict the least recently used entries
+        while self.__size > self.__max_size:
+            self.__size -= self.__entries.popitem(last=False)[1][1]
+
+
+if __name__ == "__main__":
+    pass
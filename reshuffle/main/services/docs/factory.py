@@ -1,18 +1,42 @@
 import os
 import shutil
+from io import BytesIO
 import json
+import pickle
+import hashlib
+import logging
 import openpyxl
 from openpyxl.styles.borders import Border, Side
 from openpyxl.styles import Font
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet.dimensions import Dimension
+from openpyxl.styles.named_styles import NamedStyleList
 import re
+from copy import copy, deepcopy
 from datetime import datetime
-from random import shuffle, choice, choices
+from zipfile import ZipFile, ZIP_DEFLATED
+from typing import Callable, Iterator
+from queue import Queue
+from threading import Thread
+from random import choices, sample
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from django.template.loader import render_to_string
-from reshuffle.settings import BASE_DIR, MEDIA_ROOT
+from django.db.models import Prefetch
+from django.template.loader import get_template
+from django.db import connections, transaction, IntegrityError
+from reshuffle.settings import (
+    BASE_DIR, MEDIA_ROOT, GENERATE_WORKERS, GENERATE_PARALLEL_THRESHOLD, XLSX_STREAMING, DOCS_LAYOUT
+)
 from main.models import *
-from main.services.docs.minio_client import MinioClient
+from main.services.docs.minio_client import MinioClient, UploadStream
+from main.services.docs.variants import QuestionBank, build_variants
+from main.services.docs.archive import ArchiveData
+from main.services.docs.pages import FragmentCache, PageRenderer, render_pages
+
+
+logger = logging.getLogger(__name__)
 
 
 class UniqueKey:
@@ -28,6 +52,18 @@ class UniqueKey:
     def create(self) -> str:
         return "".join(choices(self.BASE, k=self.length))
 
+    def decode(self, number: int) -> str:
+        # number of the key space [0, len(BASE) ** length) -> key
+        result = []
+        for _ in range(self.length):
+            number, i = divmod(number, len(self.BASE))
+            result.append(self.BASE[i])
+        return "".join(reversed(result))
+
+    def sample(self, count: int) -> list[str]:
+        # distinct keys (sampling without replacement from the key space)
+        return [self.decode(n) for n in sample(range(len(self.BASE) ** self.length), count)]
+
 
 class GeneratorJSON:
     """
@@ -36,10 +72,16 @@ class GeneratorJSON:
 
     __UNIQUE_KEY_LENGTH = 6
     OUTPUT_JSON = "data.json"
+    OUTPUT_MANIFEST = "manifest.json"
+    FOLDER_VARIANTS = "variants"  # one object per variant: {FOLDER_VARIANTS}/{unique_key}.json
 
-    def __init__(self, sbj_id: int, date: str) -> None:
+    def __init__(self, sbj_id: int, date: str, layout: str = DOCS_LAYOUT) -> None:
+        if layout not in ArchiveData.LAYOUTS:
+            raise ValueError(f"Unknown layout of documents: {layout}.")
         dh = DocHeader.objects.filter(is_active=True).first()
         self.__data = {
+            "version": ArchiveData.VERSION,
+            "layout": layout,
             "subject": {
                 "id": sbj_id,
                 "title": Subject.objects.get(id=sbj_id).sbj_title,
@@ -47,82 +89,207 @@ class GeneratorJSON:
             },
             "date": date,
             "doc_header": dh.content if dh else "",
+            "parts": {},
+            "tasks": {},
+            "options": {},
             "variants": []
         }
-
-    def __get_unique_keys(self, count: int) -> set[str]:
-        uk = UniqueKey(self.__UNIQUE_KEY_LENGTH)
-        result = [uk.create() for _ in range(count)]
-        while len(result) != len(set(result)):
-            result.append(uk.create())
-        return set(result)
-
-    def __collect_parts(self) -> list[dict]:
-        # init result
-        result = []
-        # populate result with parts
-        for part in Part.objects.filter(subject__id=self.__data["subject"]["id"]):
-            # create part's info
-            info = {
+        self.__bank = self.__load_bank(sbj_id)
+
+    def __load_bank(self, sbj_id: int) -> QuestionBank:
+        bank = QuestionBank(list(DIFFICULTIES.keys()))
+        # load parts, active tasks & their options (3 queries in total)
+        tasks = Task.objects.filter(is_active=True).prefetch_related("option_set")
+        qs = Part.objects.filter(subject__id=sbj_id).prefetch_related(Prefetch("task_set", queryset=tasks))
+        # populate bank: (part, position, difficulty) -> tasks
+        for part in qs:
+            bank.add_part({
                 "id": part.id,
                 "title": str(Part.TITLES[part.title]),
                 "answer_type": part.answer_type,
                 "task_count": part.task_count,
-                "difficulty_total": part.total_difficulty,
-                "difficulty_generated": 0,
+                "total_difficulty": part.total_difficulty,
                 "inst_content": part.inst_content
-            }
-            # calculate part's difficulty distribution
-            difficulties = list(DIFFICULTIES.keys())
-            distribution = [choice(difficulties) for _ in range(part.task_count)]
-            while sum(distribution) != part.total_difficulty:
-                if sum(distribution) > part.total_difficulty:
-                    i = distribution.index(choice(list(set(difficulties[1:]) & set(distribution))))
-                    distribution[i] -= 1
-                else:
-                    i = distribution.index(choice(list(set(difficulties[:-1]) & set(distribution))))
-                    distribution[i] += 1
-            shuffle(distribution)
-            # create part's material
-            material = []
-            for position in range(1, part.task_count + 1):
-                tasks = Task.objects.filter(part=part, position=position, is_active=True)
-                if tasks:
-                    # choose task
-                    tasks_filtered = tasks.filter(difficulty=distribution[position - 1])
-                    task = choice(tasks_filtered) if tasks_filtered else choice(tasks)
-                    # choose options
-                    options = Option.objects.none()
-                    if info["answer_type"] == 0:
-                        options = (
-                                Option.objects.filter(task=task, is_answer=False).order_by("?")[:3] |
-                                Option.objects.filter(task=task, is_answer=True).order_by("?")[:1]
-                        ).order_by("?")
-                    elif info["answer_type"] == 1:
-                        options = Option.objects.filter(task=task, is_answer=True)
-                    # update info's difficulty_generated field
-                    info["difficulty_generated"] += task.difficulty
-                    # append material
-                    material.append({
-                        "id": task.id,
-                        "position": f"{Part.TITLES[part.title]}{position}",
-                        "difficulty": task.difficulty,
-                        "content": task.content,
-                        "options": [{"id": o.id, "content": o.content, "is_answer": o.is_answer} for o in options]
-                    })
-            # add part's info & material to result
-            result.append({"info": info, "material": material})
-        # return populated result
-        return result
-
-    def generate(self, count: int) -> dict:
-        for unique_key in self.__get_unique_keys(count):
-            self.__data["variants"].append({"unique_key": unique_key, "parts": self.__collect_parts()})
-        return self.__data
+            })
+            for task in part.task_set.all():
+                bank.add_task(part.id, task.position, {
+                    "id": task.id,
+                    "difficulty": task.difficulty,
+                    "content": task.content,
+                    "updated": task.updated.isoformat(),
+                    "options": [{
+                        "id": o.id,
+                        "content": o.content,
+                        "is_answer": o.is_answer,
+                        "updated": o.updated.isoformat()
+                    } for o in task.option_set.all()]
+                })
+        return bank
+
+    def __get_unique_keys(self, count: int) -> list[str]:
+        # allocate keys, which have never been issued before, & reserve them in the db (archive is linked later)
+        uk = UniqueKey(self.__UNIQUE_KEY_LENGTH)
+        while True:
+            result = []
+            while len(result) < count:
+                taken = set(result)
+                candidates = [k for k in uk.sample(count - len(result)) if k not in taken]
+                issued = set(
+                    UniqueKeyEntry.objects.filter(unique_key__in=candidates).values_list("unique_key", flat=True)
+                )
+                result += [k for k in candidates if k not in issued]
+            try:
+                with transaction.atomic():
+                    UniqueKeyEntry.objects.bulk_create(
+                        [UniqueKeyEntry(unique_key=k, variant=i) for i, k in enumerate(result)],
+                        batch_size=1000
+                    )
+                return result
+            except IntegrityError:
+                # some of the keys were issued by another pack at the same time
+                continue
+
+    def __collect_content(self) -> None:
+        # store info of parts & content of the used tasks & options once (keys are str: JSON objects)
+        self.__data["parts"] = {
+            str(p["id"]): {
+                "id": p["id"],
+                "title": p["title"],
+                "answer_type": p["answer_type"],
+                "task_count": p["task_count"],
+                "difficulty_total": p["total_difficulty"],
+                "inst_content": p["inst_content"]
+            } for p in self.__bank.parts
+        }
+        tasks, options = {}, {}
+        for variant in self.__data["variants"]:
+            for part in variant["parts"]:
+                for position, task_id, option_ids in part["material"]:
+                    task = self.__bank.task(task_id)
+                    tasks[str(task_id)] = {
+                        "difficulty": task["difficulty"],
+                        "content": task["content"],
+                        "updated": task["updated"]
+                    }
+                    options |= {
+                        str(o["id"]): {"content": o["content"], "is_answer": o["is_answer"], "updated": o["updated"]}
+                        for o in task["options"] if o["id"] in option_ids
+                    }
+        self.__data["tasks"] = tasks
+        self.__data["options"] = options
+
+    def generate(self, count: int, seed: int = None) -> ArchiveData:
+        workers = GENERATE_WORKERS if count >= GENERATE_PARALLEL_THRESHOLD else 1
+        unique_keys = self.__get_unique_keys(count)
+        if workers > 1:
+            # worker processes don't use the db, so the inherited connections must not be shared with them
+            connections.close_all()
+        try:
+            self.__data["variants"] = build_variants(self.__bank, unique_keys, workers, seed)
+            self.__collect_content()
+        except Exception:
+            # release the reserved unique keys (e.g. the total difficulty of a part is unreachable)
+            UniqueKeyEntry.objects.filter(unique_key__in=unique_keys, archive__isnull=True).delete()
+            raise
+        return ArchiveData(self.__data)
+
+    def content(self) -> bytes:
+        return json.dumps(self.__data, ensure_ascii=False, separators=(",", ":")).encode()
 
     def save(self, path: str) -> None:
-        with open(os.path.join(path, self.OUTPUT_JSON), "w", encoding="UTF-8") as f:
-            json.dump(self.__data, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(path, self.OUTPUT_JSON), "wb") as f:
+            f.write(self.content())
+
+    def variant_objects(self) -> Iterator[tuple[str, bytes]]:
+        # every variant (expanded) as its own object & the manifest of unique keys: (relative alias, content)
+        data = ArchiveData(self.__data)
+        for variant in data:
+            yield (
+                f"{self.FOLDER_VARIANTS}/{variant['unique_key']}.json",
+                json.dumps(variant, ensure_ascii=False, separators=(",", ":")).encode()
+            )
+        yield (
+            f"{self.FOLDER_VARIANTS}/{self.OUTPUT_MANIFEST}",
+            json.dumps(data.manifest(), ensure_ascii=False, separators=(",", ":")).encode()
+        )
+
+
+class SheetLayout:
+    """
+    ...
+    """
+
+    __STYLES = (
+        "_fonts", "_alignments", "_borders", "_fills", "_number_formats", "_date_formats", "_timedelta_formats",
+        "_protections", "_colors", "_cell_styles", "_named_styles", "_table_styles", "_differential_styles",
+        "loaded_theme"
+    )
+
+    def __init__(self, ws: Worksheet) -> None:
+        # style tables of the workbook (style indexes of the cells refer to them), detached from the workbook
+        self.styles = {attr: getattr(ws.parent, attr) for attr in self.__STYLES}
+        self.styles["_named_styles"] = NamedStyleList([copy(style) for style in ws.parent._named_styles])
+        for style in self.styles["_named_styles"]:
+            style._wb = None
+        # precompute values & styles of all cells of the rendered sheet (row by row)
+        self.max_row, self.max_column = ws.max_row, ws.max_column
+        self.rows = [[None] * self.max_column for _ in range(self.max_row)]
+        for (row, column), cell in ws._cells.items():
+            if cell.value is not None or cell.has_style:
+                self.rows[row - 1][column - 1] = (cell.value, copy(cell._style) if cell.has_style else None)
+        # precompute sheet settings
+        self.row_dimensions = {k: self.__detach(d) for k, d in ws.row_dimensions.items()}
+        self.column_dimensions = {k: self.__detach(d) for k, d in ws.column_dimensions.items()}
+        self.merged_cells = [str(r) for r in ws.merged_cells.ranges]
+        self.sheet_format = copy(ws.sheet_format)
+        self.sheet_properties = copy(ws.sheet_properties)
+        self.page_margins = copy(ws.page_margins)
+        self.page_setup = copy(ws.page_setup)
+        self.print_options = copy(ws.print_options)
+        self.views = deepcopy(ws.views)
+
+    @staticmethod
+    def __detach(dimension: Dimension) -> Dimension:
+        dimension = copy(dimension)
+        dimension.parent = None
+        return dimension
+
+    def create_workbook(self) -> openpyxl.Workbook:
+        # write-only workbook sharing the style tables of the layout
+        wb = openpyxl.Workbook(write_only=True)
+        for attr, value in self.styles.items():
+            setattr(wb, attr, value)
+        return wb
+
+    def write(self, ws, values: dict[str, str], selected: bool = False) -> None:
+        # write the sheet to the write-only worksheet (values replace the values of the layout by coordinates)
+        for attr in ("row_dimensions", "column_dimensions"):
+            target = getattr(ws, attr)
+            for k, d in getattr(self, attr).items():
+                target[k] = copy(d)
+                target[k].parent = ws
+        for r in self.merged_cells:
+            ws.merged_cells.add(r)
+        ws.sheet_format = copy(self.sheet_format)
+        ws.sheet_properties = copy(self.sheet_properties)
+        ws.page_margins = copy(self.page_margins)
+        ws.page_setup = copy(self.page_setup)
+        ws.print_options = copy(self.print_options)
+        ws.views = deepcopy(self.views)
+        ws.sheet_view.tabSelected = selected
+        values = {coordinate_to_tuple(k): v for k, v in values.items()}
+        for r, row in enumerate(self.rows, 1):
+            cells = []
+            for c, item in enumerate(row, 1):
+                value, style = item if item else (None, None)
+                value = values.get((r, c), value)
+                if style is None:
+                    cells.append(value)
+                else:
+                    cell = WriteOnlyCell(ws, value)
+                    cell._style = copy(style)
+                    cells.append(cell)
+            ws.append(cells)
 
 
 class GeneratorXLSX:
@@ -132,6 +299,8 @@ class GeneratorXLSX:
 
     __BASE_PATH = os.path.join(MEDIA_ROOT, "base", "sheets.xlsx")
     __WS_NAME = "blank"
+    __CACHE_PATH = os.path.join(MEDIA_ROOT, "cache", "sheets")  # rendered sample sheets (SheetLayout)
+    __LAYOUT_VERSION = 1  # (!) increase on changes of __sample or SheetLayout: cached layouts of other versions miss
     OUTPUT_XLSX = "sheets.xlsx"
 
     __BORDER_THIN = Border(
@@ -141,32 +310,49 @@ class GeneratorXLSX:
         bottom=Side(style="thin")
     )
 
-    def __init__(self, custom_base_path: str = None) -> None:
+    def __init__(self, custom_base_path: str = None, streaming: bool = XLSX_STREAMING) -> None:
         self.__wb_path = custom_base_path if custom_base_path else self.__BASE_PATH
+        self.__wb = None
+        self.__ws = None
+        self.__sample_created = False
+        self.__streaming = streaming
+        if not streaming:
+            self.__load()
+
+    def __load(self) -> None:
         self.__wb = openpyxl.load_workbook(self.__wb_path)
         self.__ws = self.__wb[self.__WS_NAME]
-        self.__sample_created = False
+
+    def __labels(self, sbj_title: str, date: str, doc_header: str, unique_key: str) -> dict:
+        return {
+            "A1": re.sub(re.compile("<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});"), "", doc_header),
+            "A4": f"{sbj_title} – " + _("Entrance exams"),
+            "B7": str(_("Full name of applicant")),
+            "B9": _("Personnel file") + " №",
+            "B14": _("Variant") + " №",
+            "P13": date,
+            "N14": str(_("Exam date")),
+            "Z14": str(_("Signature of applicant")),
+            "A16": f"{sbj_title} ({date}) – " + _("Answer sheet"),
+            "A63": str(_("Correcting wrong marks")),
+            "A67": str(_("Results")),
+            "A70": str(_("Total number of\ncorrectly solved problems")),
+            "T70": str(_("Signature of examiner"))
+        } | self.__variant_labels(unique_key)
+
+    def __variant_labels(self, unique_key: str) -> dict:
+        return {
+            "D13": unique_key,
+            "A18": _("Variant") + f" № {unique_key}"
+        }
 
     def __sample(self, sbj_title: str, date: str, doc_header: str, unique_key: str, parts: list) -> None:
         # change sample_created flag
         self.__sample_created = True
         # init labels fields
         self.__ws.title = unique_key
-        self.__ws["A1"] = re.sub(re.compile("<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});"), "", doc_header)
-        self.__ws["A4"] = f"{sbj_title} – " + _("Entrance exams")
-        self.__ws["B7"] = str(_("Full name of applicant"))
-        self.__ws["B9"] = _("Personnel file") + " №"
-        self.__ws["D13"] = unique_key
-        self.__ws["B14"] = _("Variant") + " №"
-        self.__ws["P13"] = date
-        self.__ws["N14"] = str(_("Exam date"))
-        self.__ws["Z14"] = str(_("Signature of applicant"))
-        self.__ws["A16"] = f"{sbj_title} ({date}) – " + _("Answer sheet")
-        self.__ws["A18"] = _("Variant") + f" № {unique_key}"
-        self.__ws["A63"] = str(_("Correcting wrong marks"))
-        self.__ws["A67"] = str(_("Results"))
-        self.__ws["A70"] = str(_("Total number of\ncorrectly solved problems"))
-        self.__ws["T70"] = str(_("Signature of examiner"))
+        for coordinate, value in self.__labels(sbj_title, date, doc_header, unique_key).items():
+            self.__ws[coordinate] = value
         # split parts for correct render
         parts_splitted = []
         for part in parts:
@@ -228,25 +414,57 @@ class GeneratorXLSX:
         # copy sample & change title
         self.__wb.copy_worksheet(self.__ws).title = unique_key
         # change labels fields
-        self.__wb[unique_key]["D13"] = unique_key
-        self.__wb[unique_key]["A18"] = _("Variant") + f" № {unique_key}"
-
-    def generate(self, data: dict) -> None:
-        for variant in data["variants"]:
+        for coordinate, value in self.__variant_labels(unique_key).items():
+            self.__wb[unique_key][coordinate] = value
+
+    def __layout(self, data: ArchiveData, parts: list) -> SheetLayout:
+        # the sample sheet depends only on the layout of parts & the base workbook (labels are stamped on every sheet)
+        # (!) pickles hold private style objects of openpyxl, so its version is a part of the key
+        key = hashlib.sha256(json.dumps([
+            self.__LAYOUT_VERSION, openpyxl.__version__, parts, self.__wb_path, os.path.getmtime(self.__wb_path)
+        ]).encode()).hexdigest()
+        path = os.path.join(self.__CACHE_PATH, f"{key}.pickle")
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    layout = pickle.load(f)
+                logger.info(f"Sheet layout cache hit: {key}")
+                return layout
+            except Exception as e:
+                logger.warning(f"Sheet layout cache entry {key} is broken: {e}")
+        logger.info(f"Sheet layout cache miss: {key}")
+        # render the sample sheet & save its layout
+        self.__load()
+        self.__sample(data.subject["title"], data.date, data.doc_header, data.unique_keys()[0], parts)
+        layout = SheetLayout(self.__ws)
+        os.makedirs(self.__CACHE_PATH, exist_ok=True)
+        with open(f"{path}.{os.getpid()}", "wb") as f:
+            pickle.dump(layout, f)
+        os.replace(f"{path}.{os.getpid()}", path)
+        return layout
+
+    def __stream(self, layout: SheetLayout, data: ArchiveData) -> None:
+        # write every sheet from the layout to a write-only workbook (rows are streamed to disk sheet by sheet)
+        wb = layout.create_workbook()
+        labels = self.__labels(data.subject["title"], data.date, data.doc_header, "")
+        for i, unique_key in enumerate(data.unique_keys()):
+            layout.write(wb.create_sheet(unique_key), labels | self.__variant_labels(unique_key), selected=not i)
+        self.__wb = wb
+
+    def generate(self, data: ArchiveData) -> None:
+        parts = [{
+            "title": p["title"],
+            "answer_type": p["answer_type"],
+            "task_count": p["task_count"]
+        } for p in data.parts()]
+        if self.__streaming:
+            self.__stream(self.__layout(data, parts), data)
+            return
+        for unique_key in data.unique_keys():
             if not self.__sample_created:
-                self.__sample(
-                    data["subject"]["title"],
-                    data["date"],
-                    data["doc_header"],
-                    variant["unique_key"],
-                    [{
-                        "title": p["info"]["title"],
-                        "answer_type": p["info"]["answer_type"],
-                        "task_count": p["info"]["task_count"]
-                    } for p in variant["parts"]]
-                )
+                self.__sample(data.subject["title"], data.date, data.doc_header, unique_key, parts)
             else:
-                self.__reproduce(variant["unique_key"])
+                self.__reproduce(unique_key)
 
     def save(self, path: str) -> None:
         path = os.path.join(path, self.OUTPUT_XLSX)
@@ -264,29 +482,110 @@ class GeneratorPDF:
     ...
     """
 
-    __TEMPLATE_TASKS_PATH = "docs/template_tasks.html"
-    __TEMPLATE_ANSWERS_PATH = "docs/template_answers.html"
+    __TEMPLATES_TASKS = ("docs/template_tasks_head.html", "docs/template_tasks_variant.html",
+                         "docs/template_tasks_tail.html")
+    __TEMPLATES_ANSWERS = ("docs/template_answers_head.html", "docs/template_answers_variant.html",
+                           "docs/template_answers_tail.html")
+    __TEMPLATE_INDEX = "docs/template_index.html"
+    __QUEUE_SIZE = 64  # rendered fragments waiting to be written
     OUTPUT_TASKS_HTML = "tasks.html"
     OUTPUT_ANSWERS_HTML = "answers.html"
+    OUTPUT_INDEX_HTML = "index.html"  # split layout: links to the documents of every variant
 
-    def __init__(self) -> None:
-        self.__html_tasks = ""
-        self.__html_answers = ""
+    def __init__(self, workers: int = GENERATE_WORKERS) -> None:
+        self.__data = None
+        self.__workers = workers
+        self.stats = {"fragments": None, "formulas": None}
 
-    def generate(self, data: dict) -> None:
-        # generate tasks [HTML]
-        self.__html_tasks = render_to_string(
-            template_name=self.__TEMPLATE_TASKS_PATH,
-            context=data | {"base_dir": json.dumps(str(BASE_DIR))}
-        )
-        # generate answers [HTML]
-        self.__html_answers = render_to_string(template_name=self.__TEMPLATE_ANSWERS_PATH, context=data)
+    def generate(self, data: ArchiveData) -> None:
+        # (!) documents are rendered on save: every variant is rendered & written separately
+        self.__data = data
 
     def save(self, path: str) -> None:
-        save_list = [(self.__html_tasks, self.OUTPUT_TASKS_HTML), (self.__html_answers, self.OUTPUT_ANSWERS_HTML)]
-        for content, output in save_list:
-            with open(os.path.join(path, output), "w", encoding="UTF-8") as f:
-                f.write(content)
+        # layout of the documents is recorded in the archive data
+        if self.__data.layout == ArchiveData.LAYOUT_SPLIT:
+            self.__save_split(path)
+        else:
+            self.__save_single(path)
+
+    def __write(self, files: list, fragments: Queue, errors: list) -> None:
+        # write rendered fragments in order (after an error the rest is consumed, so the renderer doesn't block)
+        while (item := fragments.get()) is not None:
+            if not errors:
+                try:
+                    files[item[0]].write(item[1])
+                except Exception as e:
+                    errors.append(e)
+
+    def __save_single(self, path: str) -> None:
+        templates = [
+            [get_template(t) for t in self.__TEMPLATES_TASKS],
+            [get_template(t) for t in self.__TEMPLATES_ANSWERS]
+        ]
+        cache = FragmentCache()
+        context = cache.context(self.__data.context())
+        context.pop("variants")
+        contexts = [
+            context | {"base_dir": json.dumps(str(BASE_DIR))},
+            context | {"unique_keys": self.__data.unique_keys()}
+        ]
+        outputs = [self.OUTPUT_TASKS_HTML, self.OUTPUT_ANSWERS_HTML]
+        files = [open(os.path.join(path, output), "w", encoding="UTF-8") for output in outputs]
+        fragments, errors = Queue(maxsize=self.__QUEUE_SIZE), []
+        writer = Thread(target=self.__write, args=(files, fragments, errors))
+        writer.start()
+        try:
+            # render heads, every variant & tails of the documents (written by the writer thread meanwhile)
+            for i in range(len(outputs)):
+                fragments.put((i, templates[i][0].render(contexts[i])))
+            for variant in self.__data:
+                if errors:
+                    break
+                cache.prepare(variant)
+                for i in range(len(outputs)):
+                    fragments.put((i, templates[i][1].render(contexts[i] | {"variant": variant})))
+            # MathJax is loaded only if some formulas were not rendered
+            for i in range(len(outputs)):
+                fragments.put((i, templates[i][2].render(contexts[i] | {
+                    "formulas_pending": cache.formulas.pending > 0
+                })))
+        finally:
+            fragments.put(None)
+            writer.join()
+            for f in files:
+                f.close()
+        if errors:
+            raise errors[0]
+        self.stats = {
+            "fragments": cache.stats(),
+            "formulas": {"rendered": cache.formulas.rendered, "pending": cache.formulas.pending}
+        }
+
+    def __save_split(self, path: str) -> None:
+        # every variant is rendered to its own files by the pool of processes
+        if self.__workers > 1 and len(self.__data) > 1:
+            # worker processes don't use the db, so the inherited connections must not be shared with them
+            connections.close_all()
+        counters = render_pages(
+            self.__data, path, [self.__TEMPLATES_TASKS, self.__TEMPLATES_ANSWERS], self.__workers
+        )
+        with open(os.path.join(path, self.OUTPUT_INDEX_HTML), "w", encoding="UTF-8") as f:
+            f.write(get_template(self.__TEMPLATE_INDEX).render({
+                "subject": self.__data.subject,
+                "date": self.__data.date,
+                "unique_keys": self.__data.unique_keys(),
+                "folder_tasks": PageRenderer.FOLDER_TASKS,
+                "folder_answers": PageRenderer.FOLDER_ANSWERS
+            }))
+        total = counters["hits"] + counters["misses"]
+        self.stats = {
+            "fragments": {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "hit_ratio": round(counters["hits"] / total, 4) if total else 0
+            },
+            "formulas": {"rendered": counters["rendered"], "pending": counters["pending"]}
+        }
 
 
 class DocumentPackager:
@@ -295,10 +594,12 @@ class DocumentPackager:
     """
 
     __OUTPUT_PATH = os.path.join(MEDIA_ROOT, "docs")
+    __CHUNK_SIZE = 1024 * 1024  # bytes read at once while a file is added to the archive
     ARCHIVE_FORMAT = "zip"
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, progress: Callable[[str, str], None] = None) -> None:
+        self.__progress = progress if progress else lambda stage, state: None
+        self.stats = {}
 
     def __create_folder(self, name: str) -> str:
         folder = os.path.join(self.__OUTPUT_PATH, name)
@@ -306,50 +607,99 @@ class DocumentPackager:
             os.makedirs(folder)
         return folder
 
-    def __archive_folder(self, folder: str, delete: bool = True) -> str:
-        shutil.make_archive(folder, self.ARCHIVE_FORMAT, folder)
-        if delete:
-            shutil.rmtree(folder)
-        return f"{folder}.{self.ARCHIVE_FORMAT}"
+    def __archive_files(self, archive: ZipFile, folder: str) -> None:
+        # move the files of the folder into the archive stream (local copies are deleted at once)
+        for root, _dirs, files in os.walk(folder):
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                arcname = os.path.relpath(file, folder).replace("\\", "/")
+                with open(file, "rb") as src, archive.open(arcname, "w") as dst:
+                    while chunk := src.read(self.__CHUNK_SIZE):
+                        dst.write(chunk)
+                os.remove(file)
+
+    def __discard(self, mc: MinioClient, prefix: str, folder: str, stream: UploadStream | None,
+                  data: ArchiveData | None) -> None:
+        # discard the archive, the uploaded objects & the local files of the failed pack (the original error is kept)
+        if stream is not None:
+            stream.abort()
+        try:
+            errors = mc.delete_objects([f"{prefix}/", f"{prefix}.{self.ARCHIVE_FORMAT}"])
+            for alias, messages in errors.items():
+                logger.error(f"Objects of the failed pack cannot be deleted ({alias}): {'; '.join(messages)}")
+        except Exception as e:
+            logger.error(f"Objects of the failed pack cannot be deleted ({prefix}): {type(e).__name__}: {e}")
+        shutil.rmtree(folder, ignore_errors=True)
+        # release the reserved unique keys of the failed pack
+        if data is not None:
+            UniqueKeyEntry.objects.filter(unique_key__in=data.unique_keys(), archive__isnull=True).delete()
 
     def pack(self, user_id: int, sbj_id: int, count: int, date: str) -> str:
         # init object storage client
-        mc = MinioClient()
+        mc = MinioClient.shared()
         # find related subject
         sbj = Subject.objects.get(id=sbj_id)
-        # create output folder
+        # create output folder (holds the output of one generator at a time)
         folder = self.__create_folder(
             f"[{datetime.today().strftime('%d.%m.%Y_%H.%M.%S.%f')}][{sbj.sbj_title}][{count}][{date}]"
         )
-        # create data [JSON]
-        gen_json = GeneratorJSON(sbj_id, date)
-        data = gen_json.generate(count)
-        gen_json.save(folder)
-        # create sheets [XLSX]
-        gen_xlsx = GeneratorXLSX()
-        gen_xlsx.generate(data)
-        gen_xlsx.save(folder)
-        # create tasks & answers [PDF]
-        gen_pdf = GeneratorPDF()
-        gen_pdf.generate(data)
-        gen_pdf.save(folder)
-        # send output folder to object storage
-        mc.upload_folder(folder)
-        # archive & delete output folder
-        archive = self.__archive_folder(folder)
-        # send archive to object storage
-        mc.upload_file(archive)
-        # delete archive
-        os.remove(archive)
-        # add object storage entry to db
-        ObjectStorageEntry.objects.create(
-            user=User.objects.get(id=user_id),
-            subject=sbj,
-            amount=count,
-            date=timezone.make_aware(datetime.strptime(date, "%d.%m.%Y"), timezone=timezone.get_current_timezone()),
-            prefix=folder.split("\\")[-1]
-        )
-        return folder.split("\\")[-1]
+        prefix = os.path.basename(folder)
+        data, stream = None, None
+        try:
+            # create data [JSON]
+            self.__progress("json", "running")
+            gen_json = GeneratorJSON(sbj_id, date)
+            data = gen_json.generate(count)
+            # (!) the archive is uploaded while it is written: outputs of the generators are added to it one by one
+            stream = mc.open_upload_stream(f"{prefix}.{self.ARCHIVE_FORMAT}")
+            with ZipFile(stream, "w", ZIP_DEFLATED) as archive:
+                content = gen_json.content()
+                mc.upload_bytes(BytesIO(content), f"{prefix}/{GeneratorJSON.OUTPUT_JSON}", len(content))
+                archive.writestr(GeneratorJSON.OUTPUT_JSON, content)
+                self.__progress("json", "done")
+                # send per-variant objects to object storage (they are not archived)
+                self.__progress("upload", "running")
+                mc.upload_objects((f"{prefix}/{alias}", content) for alias, content in gen_json.variant_objects())
+                self.__progress("upload", "done")
+                # create sheets [XLSX]
+                self.__progress("xlsx", "running")
+                gen_xlsx = GeneratorXLSX()
+                gen_xlsx.generate(data)
+                gen_xlsx.save(folder)
+                self.__archive_files(archive, folder)
+                self.__progress("xlsx", "done")
+                # create tasks & answers [PDF]
+                self.__progress("pdf", "running")
+                gen_pdf = GeneratorPDF()
+                gen_pdf.generate(data)
+                gen_pdf.save(folder)
+                self.stats["pdf"] = gen_pdf.stats
+                logger.info(f"Tasks & answers: {gen_pdf.stats}")
+                self.__archive_files(archive, folder)
+                self.__progress("pdf", "done")
+                # finish the archive (the central directory) & the upload
+                self.__progress("archive", "running")
+            stream.close()
+            self.__progress("archive", "done")
+            shutil.rmtree(folder)
+            with transaction.atomic():
+                # add object storage entry to db
+                entry = ObjectStorageEntry.objects.create(
+                    user=User.objects.get(id=user_id),
+                    subject=sbj,
+                    amount=count,
+                    date=timezone.make_aware(
+                        datetime.strptime(date, "%d.%m.%Y"),
+                        timezone=timezone.get_current_timezone()
+                    ),
+                    prefix=prefix
+                )
+                # link the reserved unique keys to the archive
+                UniqueKeyEntry.objects.filter(unique_key__in=data.unique_keys()).update(archive=entry)
+        except Exception:
+            self.__discard(mc, prefix, folder, stream, data)
+            raise
+        return prefix
 
 
 if __name__ == "__main__":
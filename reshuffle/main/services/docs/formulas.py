@@ -0,0 +1,96 @@
+import os
+import re
+import hashlib
+import logging
+from io import BytesIO
+from html import escape, unescape
+from base64 import b64encode
+from reshuffle.settings import MEDIA_ROOT
+
+try:
+    from matplotlib import mathtext, rc_context
+    from matplotlib.font_manager import FontProperties
+except ImportError:  # (!) without matplotlib (see requirements) formulas are typeset by MathJax in the browser
+    mathtext = None
+
+logger = logging.getLogger(__name__)
+
+
+class FormulaRenderer:
+    """
+    ...
+    """
+
+    __CACHE_PATH = os.path.join(MEDIA_ROOT, "cache", "math")  # rendered formulas (SVG), shared by all packs
+    __VERSION = 1  # change to invalidate the cache (e.g. when the rendering params are changed)
+    __FONT_SIZE = 10.5  # pt (= 14px, font size of the documents)
+    __DPI = 72  # 1px of the image = 1pt
+    __RC = {"svg.hashsalt": "reshuffle"}  # fixed IDs of the SVG elements (the same formula -> the same file)
+    __DEPTH = re.compile(r'data-depth="([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"')
+
+    # formulas of the CKEditor mathjax plugin: <span class="math-tex">\( inline \)</span> or \[ display \]
+    __PATTERN = re.compile(r'<span class="math-tex">\s*(\\\(|\\\[)(.*?)(\\\)|\\\])\s*</span>', re.DOTALL)
+
+    def __init__(self) -> None:
+        self.__svg = {}  # TeX -> <img> (None if it cannot be rendered)
+        self.rendered = 0
+        self.pending = 0  # formulas left for MathJax
+
+    def __image(self, tex: str, display: bool) -> str | None:
+        key = hashlib.sha256(f"{self.__VERSION}|{display}|{tex}".encode()).hexdigest()
+        path = os.path.join(self.__CACHE_PATH, f"{key}.svg")
+        if not os.path.exists(path):
+            buffer = BytesIO()
+            try:
+                with rc_context(self.__RC):
+                    depth = mathtext.math_to_image(
+                        f"${tex}$",
+                        buffer,
+                        prop=FontProperties(size=self.__FONT_SIZE * (1.2 if display else 1)),
+                        dpi=self.__DPI,
+                        format="svg"
+                    )
+            except Exception as e:
+                logger.warning(f"Formula cannot be rendered ({tex}): {str(e).strip().splitlines()[-1]}")
+                return None
+            # keep the root element only & store the offset of the baseline (depth) in it
+            svg = buffer.getvalue().decode()
+            svg = re.sub(r"<metadata>.*?</metadata>\s*", "", svg[svg.index("<svg"):], flags=re.DOTALL)
+            svg = svg.replace("<svg ", f'<svg data-depth="{depth}" ', 1)
+            os.makedirs(self.__CACHE_PATH, exist_ok=True)
+            with open(f"{path}.{os.getpid()}", "w", encoding="UTF-8") as f:
+                f.write(svg)
+            os.replace(f"{path}.{os.getpid()}", path)
+        with open(path, encoding="UTF-8") as f:
+            svg = f.read()
+        match = self.__DEPTH.search(svg)
+        if not match:
+            logger.warning(f"Cached formula is invalid ({tex}): {path}")
+            os.remove(path)
+            return None
+        depth = float(match.group(1))
+        style = "display: block; margin: 4px auto;" if display else f"vertical-align: {-depth}pt;"
+        return (
+            f'<img class="math-tex" alt="{escape(tex)}" style="{style}" '
+            f'src="data:image/svg+xml;base64,{b64encode(svg.encode()).decode()}">'
+        )
+
+    def __replace(self, match: re.Match) -> str:
+        tex = unescape(match.group(2)).strip()
+        display = match.group(1) == "\\["
+        if mathtext and (tex, display) not in self.__svg:
+            self.__svg[(tex, display)] = self.__image(tex, display)
+        img = self.__svg.get((tex, display))
+        if img is None:
+            self.pending += 1
+            return match.group(0)
+        self.rendered += 1
+        return img
+
+    def render(self, html: str) -> str:
+        # replace formulas of the HTML with images (formulas, which cannot be rendered, are kept for MathJax)
+        return self.__PATTERN.sub(self.__replace, html) if html else html
+
+
+if __name__ == "__main__":
+    pass
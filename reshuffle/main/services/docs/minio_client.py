@@ -1,12 +1,23 @@
-from os import path
-from glob import glob, escape
+import os
+from time import sleep
 from datetime import timedelta
+from typing import Callable, Iterable
 from io import BytesIO
-from urllib3 import BaseHTTPResponse, HTTPResponse
+from queue import Queue
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from urllib3 import BaseHTTPResponse, HTTPResponse, PoolManager, Timeout, Retry
+from urllib3.exceptions import HTTPError
 from minio import Minio
+from minio.error import S3Error, ServerError
+from minio.helpers import MIN_PART_SIZE
 from minio.datatypes import Object
 from minio.commonconfig import CopySource
-from reshuffle.settings import MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME
+from minio.deleteobjects import DeleteObject
+from reshuffle.settings import (
+    MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME, MINIO_POOL_SIZE, MINIO_TIMEOUT,
+    UPLOAD_WORKERS, UPLOAD_RETRIES
+)
 
 
 class MinioClient:
@@ -14,33 +25,99 @@ class MinioClient:
     ...
     """
 
+    __RETRY_BACKOFF = 0.5  # seconds before the first retry of an upload (doubled for every next retry)
+    __RETRY_CODES = ("InternalError", "RequestTimeout", "ServiceUnavailable", "SlowDown")  # S3 errors to retry
+
+    __shared = None
+    __shared_pid = None
+    __shared_lock = Lock()
+
     def __init__(self) -> None:
+        # (!) use MinioClient.shared(): every client has its own pool of connections & checks the bucket
         self.__client = Minio(
             endpoint=MINIO_ENDPOINT,
             access_key=MINIO_ACCESS_KEY,
             secret_key=MINIO_SECRET_KEY,
-            secure=False
+            secure=False,
+            http_client=PoolManager(
+                # connections are kept alive & reused by the threads (requests, concurrent uploads)
+                num_pools=1,
+                maxsize=MINIO_POOL_SIZE,
+                timeout=Timeout(connect=MINIO_TIMEOUT, read=MINIO_TIMEOUT),
+                retries=Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+            )
         )
         self.__bucket_name = MINIO_BUCKET_NAME
         if not self.__client.bucket_exists(self.__bucket_name):
             self.__client.make_bucket(self.__bucket_name)
 
-    def upload_folder(self, folder: str, alias: str = None) -> None:
+    @classmethod
+    def shared(cls) -> "MinioClient":
+        # thread-safe client of the process (forked processes create their own, connections can't be shared)
+        with cls.__shared_lock:
+            if cls.__shared is None or cls.__shared_pid != os.getpid():
+                cls.__shared = cls()
+                cls.__shared_pid = os.getpid()
+            return cls.__shared
+
+    def __retry(self, upload: Callable[[], object]) -> None:
+        # retry transient failures (connection errors, overloaded server) with exponential backoff
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                upload()
+                return
+            except (HTTPError, OSError, ServerError, S3Error) as e:
+                if attempt == UPLOAD_RETRIES or (isinstance(e, S3Error) and e.code not in self.__RETRY_CODES):
+                    raise
+                sleep(self.__RETRY_BACKOFF * 2 ** attempt)
+
+    def __upload_all(self, uploads: Iterable[tuple[str, Callable[[], object]]], workers: int) -> None:
+        # run uploads by the pool of threads (at most 2 uploads per thread are queued, so lazy content stays lazy)
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending: dict[Future, str] = {}
+            for alias, upload in uploads:
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception():
+                            errors.append((pending[future], future.exception()))
+                        del pending[future]
+                pending[executor.submit(self.__retry, upload)] = alias
+            for future, alias in pending.items():
+                if future.exception():
+                    errors.append((alias, future.exception()))
+        if errors:
+            raise ExceptionGroup(
+                f"{len(errors)} object(s) failed to upload: {', '.join(a for a, _ in errors[:5])}",
+                [e for _, e in errors]
+            )
+
+    def upload_folder(self, folder: str, alias: str = None, workers: int = UPLOAD_WORKERS) -> None:
         if not alias:
-            alias = folder.split("\\")[-1]
-        for f in glob(escape(folder) + "/**"):
-            if not path.isfile(f):
-                self.upload_folder(f, path.join(alias, f.split("\\")[-1]))
-            else:
-                self.__client.fput_object(
-                    bucket_name=self.__bucket_name,
-                    object_name=path.join(alias, f.split("\\")[-1]).replace("\\", "/"),
-                    file_path=f
-                )
+            alias = os.path.basename(folder)
+
+        def uploads():
+            for root, _dirs, files in os.walk(folder):
+                for name in files:
+                    file = os.path.join(root, name)
+                    object_name = f"{alias}/{os.path.relpath(file, folder)}".replace("\\", "/")
+                    yield object_name, lambda o=object_name, f=file: self.__client.fput_object(
+                        bucket_name=self.__bucket_name, object_name=o, file_path=f
+                    )
+
+        self.__upload_all(uploads(), workers)
+
+    def upload_objects(self, objects: Iterable[tuple[str, bytes]], workers: int = UPLOAD_WORKERS) -> None:
+        # upload (alias, content) pairs concurrently, the content may be produced lazily
+        uploads = (
+            (alias, lambda a=alias, c=content: self.upload_bytes(BytesIO(c), a, len(c))) for alias, content in objects
+        )
+        self.__upload_all(uploads, workers)
 
     def upload_file(self, file: str, alias: str = None) -> None:
         if not alias:
-            alias = file.split("\\")[-1]
+            alias = os.path.basename(file)
         self.__client.fput_object(bucket_name=self.__bucket_name, object_name=alias, file_path=file)
 
     def upload_bytes(self, obj: BytesIO, alias: str, length: int, part_size: int = 0) -> None:
@@ -52,10 +129,19 @@ class MinioClient:
             part_size=part_size
         )
 
+    def open_upload_stream(self, alias: str) -> "UploadStream":
+        # object of unknown length: bytes written to the stream are uploaded by parts meanwhile
+        return UploadStream(self.upload_bytes, alias)
+
     def get_object_content(self, alias: str, decoded: bool = True) -> str | HTTPResponse | BaseHTTPResponse:
+        # (!) the caller must close & release the response if it isn't decoded
         obj = self.__client.get_object(bucket_name=self.__bucket_name, object_name=alias)
         if decoded:
-            return obj.data.decode()
+            try:
+                return obj.data.decode()
+            finally:
+                obj.close()
+                obj.release_conn()
         return obj
 
     def get_object_stats(self, alias: str) -> Object:
@@ -78,8 +164,87 @@ class MinioClient:
         self.__client.remove_object(bucket_name=self.__bucket_name, object_name=alias_old)
 
     def delete_object(self, alias: str) -> None:
-        for o in self.__client.list_objects(bucket_name=self.__bucket_name, prefix=alias, recursive=True):
-            self.__client.remove_object(bucket_name=self.__bucket_name, object_name=o.object_name)
+        errors = self.delete_objects([alias])
+        if errors:
+            raise IOError(f"Objects of {alias} cannot be deleted: {'; '.join(errors[alias])}")
+
+    def delete_objects(self, aliases: Iterable[str]) -> dict[str, list[str]]:
+        # delete the objects of all prefixes by multi-object requests (up to 1000 keys each), return errors by prefix
+        owners = {}  # object name -> prefix
+
+        def objects():
+            for alias in aliases:
+                for o in self.__client.list_objects(bucket_name=self.__bucket_name, prefix=alias, recursive=True):
+                    owners[o.object_name] = alias
+                    yield DeleteObject(o.object_name)
+
+        errors = {}
+        for e in self.__client.remove_objects(bucket_name=self.__bucket_name, delete_object_list=objects()):
+            errors.setdefault(owners.get(e.name, e.name), []).append(f"{e.name}: {e.code} ({e.message})")
+        return errors
+
+
+class UploadStream:
+    """
+    ...
+    """
+
+    __QUEUE_SIZE = 64  # written chunks waiting to be uploaded
+    PART_SIZE = MIN_PART_SIZE  # (!) size of the multipart upload parts, every part is buffered in memory
+
+    def __init__(self, upload: Callable[[object, str, int, int], None], alias: str) -> None:
+        self.__chunks = Queue(maxsize=self.__QUEUE_SIZE)
+        self.__buffer = bytearray()
+        self.__aborted = False
+        self.__errors = []
+        self.__uploader = Thread(target=self.__upload, args=(upload, alias))
+        self.__uploader.start()
+
+    def __upload(self, upload: Callable[[object, str, int, int], None], alias: str) -> None:
+        # upload the stream of unknown length by parts (after an error the rest is consumed, so writes don't block)
+        try:
+            upload(self, alias, -1, self.PART_SIZE)
+        except Exception as e:
+            self.__errors.append(e)
+            while self.__chunks.get() is not None:
+                pass
+
+    def read(self, size: int = -1) -> bytes:
+        # called by the uploader thread
+        while size < 0 or len(self.__buffer) < size:
+            chunk = self.__chunks.get()
+            if chunk is None:
+                self.__chunks.put(None)  # keep the end of the stream for the next reads
+                if self.__aborted:
+                    raise IOError("The upload stream was aborted.")
+                break
+            self.__buffer += chunk
+        size = len(self.__buffer) if size < 0 else size
+        result = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return result
+
+    def write(self, b: bytes) -> int:
+        if self.__errors:
+            raise self.__errors[0]
+        self.__chunks.put(bytes(b))
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        # finish the upload & wait for it
+        self.__chunks.put(None)
+        self.__uploader.join()
+        if self.__errors:
+            raise self.__errors[0]
+
+    def abort(self) -> None:
+        # discard the upload (incomplete parts are removed by the object storage)
+        self.__aborted = True
+        self.__chunks.put(None)
+        self.__uploader.join()
 
 
 if __name__ == "__main__":
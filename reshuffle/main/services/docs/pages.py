@@ -0,0 +1,159 @@
+import os
+import json
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.apps import apps
+from django.template.loader import get_template
+from reshuffle.settings import BASE_DIR
+from main.services.docs.archive import ArchiveData
+from main.services.docs.formulas import FormulaRenderer
+
+# (!) this module must not import the models: its functions are executed by the worker processes of the pool
+
+
+class FragmentCache:
+    """
+    ...
+    """
+
+    __TEMPLATE_TASK_PATH = "docs/template_fragment_task.html"
+    __TEMPLATE_OPTION_PATH = "docs/template_fragment_option.html"
+
+    def __init__(self) -> None:
+        self.__templates = {
+            "task": get_template(self.__TEMPLATE_TASK_PATH),
+            "option": get_template(self.__TEMPLATE_OPTION_PATH)
+        }
+        self.__fragments = {}
+        self.formulas = FormulaRenderer()
+        self.hits = 0
+        self.misses = 0
+
+    def __render(self, kind: str, item: dict) -> tuple[str, str, int]:
+        # the same task (option) is rendered once per pack: key is (kind, ID, date updated)
+        key = (kind, item["id"], item.get("updated"))
+        if key in self.__fragments:
+            self.hits += 1
+        else:
+            self.misses += 1
+            pending = self.formulas.pending
+            item = item | {"content": self.formulas.render(item["content"])}
+            self.__fragments[key] = (
+                item["content"], self.__templates[kind].render({kind: item}), self.formulas.pending - pending
+            )
+        return self.__fragments[key]
+
+    def __text(self, key: tuple, text: str) -> tuple[str, int]:
+        # the same text (e.g. instructions of the part) is processed once per pack
+        if key not in self.__fragments:
+            pending = self.formulas.pending
+            self.__fragments[key] = (self.formulas.render(text), self.formulas.pending - pending)
+        return self.__fragments[key]
+
+    def prepare(self, variant: dict) -> dict:
+        # add pre-rendered HTML to every task & option of the variant (formulas of the content are rendered)
+        pending = 0  # formulas of the variant left for MathJax
+        for part in variant["parts"]:
+            part["info"]["inst_content"], n = self.__text(("part", part["info"]["id"]), part["info"]["inst_content"])
+            pending += n
+            for task in part["material"]:
+                task["content"], task["html"], n = self.__render("task", task)
+                pending += n
+                for option in task["options"]:
+                    option["content"], option["html"], n = self.__render("option", option)
+                    pending += n
+        variant["formulas_pending"] = pending
+        return variant
+
+    def context(self, context: dict) -> dict:
+        # render formulas of the common fields of the documents
+        return context | {
+            "subject": context["subject"] | {"inst_content": self.formulas.render(context["subject"]["inst_content"])},
+            "doc_header": self.formulas.render(context["doc_header"])
+        }
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": round(self.hits / total, 4) if total else 0}
+
+
+class PageRenderer:
+    """
+    ...
+    """
+
+    FOLDER_TASKS = "tasks"  # one document per variant: {FOLDER_TASKS}/{unique_key}.html
+    FOLDER_ANSWERS = "answers"  # one document per variant: {FOLDER_ANSWERS}/{unique_key}.html
+
+    def __init__(self, data: ArchiveData, path: str, templates: list[tuple[str, str, str]]) -> None:
+        self.__data = data
+        self.__templates = [[get_template(t) for t in names] for names in templates]
+        self.__folders = [os.path.join(path, self.FOLDER_TASKS), os.path.join(path, self.FOLDER_ANSWERS)]
+        self.cache = FragmentCache()
+        # common fields of the documents (formulas are rendered once)
+        context = self.cache.context(data.context())
+        context.pop("variants")
+        self.__pending = self.cache.formulas.pending > 0
+        self.__contexts = [context | {"base_dir": json.dumps(str(BASE_DIR))}, context]
+
+    def render(self, unique_keys: list[str]) -> dict:
+        # render & write the tasks & answers documents of every variant, return counters of this call
+        hits, misses = self.cache.hits, self.cache.misses
+        rendered, pending = self.cache.formulas.rendered, self.cache.formulas.pending
+        for unique_key in unique_keys:
+            variant = self.cache.prepare(self.__data.variant(unique_key))
+            for templates, context, folder in zip(self.__templates, self.__contexts, self.__folders):
+                # MathJax is loaded only by the documents with formulas, which were not rendered
+                context = context | {
+                    "variant": variant,
+                    "formulas_pending": self.__pending or variant["formulas_pending"] > 0
+                }
+                with open(os.path.join(folder, f"{unique_key}.html"), "w", encoding="UTF-8") as f:
+                    for template in templates:
+                        f.write(template.render(context))
+        return {
+            "hits": self.cache.hits - hits,
+            "misses": self.cache.misses - misses,
+            "rendered": self.cache.formulas.rendered - rendered,
+            "pending": self.cache.formulas.pending - pending
+        }
+
+
+# PARALLEL RENDERING ------------------------------------------------------------------------------------------------- #
+CHUNK_SIZE = 25  # variants per task of the pool
+
+_worker_renderer = None
+
+
+def _init_worker(raw: dict, path: str, templates: list[tuple[str, str, str]]) -> None:
+    # receive the archive data once per worker process (spawned processes must set up django themselves)
+    global _worker_renderer
+    if not apps.ready:
+        django.setup()
+    _worker_renderer = PageRenderer(ArchiveData(raw), path, templates)
+
+
+def _render_chunk(unique_keys: list[str]) -> dict:
+    return _worker_renderer.render(unique_keys)
+
+
+def render_pages(data: ArchiveData, path: str, templates: list[tuple[str, str, str]], workers: int = 1) -> dict:
+    # write tasks & answers documents of every variant to separate files, return summed counters of all chunks
+    for folder in (PageRenderer.FOLDER_TASKS, PageRenderer.FOLDER_ANSWERS):
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    unique_keys = data.unique_keys()
+    chunks = [unique_keys[i:i + CHUNK_SIZE] for i in range(0, len(unique_keys), CHUNK_SIZE)]
+    # render chunks sequentially or by the pool of processes (every worker has its own fragment cache)
+    if workers <= 1 or len(chunks) <= 1:
+        results = [PageRenderer(data, path, templates).render(unique_keys)]
+    else:
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)), initializer=_init_worker, initargs=(data.raw, path, templates)
+        ) as executor:
+            results = list(executor.map(_render_chunk, chunks, chunksize=max(1, ceil(len(chunks) / workers / 4))))
+    return {k: sum(r[k] for r in results) for k in ("hits", "misses", "rendered", "pending")}
+
+
+if __name__ == "__main__":
+    pass
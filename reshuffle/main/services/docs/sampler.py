@@ -0,0 +1,52 @@
+import numpy as np
+from numpy import ndarray
+
+
+class DifficultySampler:
+    """
+    ...
+    """
+
+    def __init__(self, difficulties: list[int]) -> None:
+        # difficulties are consecutive integers: [low, low + 1, ..., low + levels - 1]
+        self.__low = min(difficulties)
+        self.__levels = len(difficulties)
+        self.__cache = {}  # task count -> counts
+
+    def __counts(self, task_count: int) -> ndarray:
+        # counts[k][s] = amount of vectors of length k (values 0 .. levels - 1) with sum s
+        if task_count in self.__cache:
+            return self.__cache[task_count]
+        s_max = task_count * (self.__levels - 1)
+        counts = np.zeros((task_count + 1, s_max + 1), dtype=np.float64)
+        counts[0][0] = 1
+        for k in range(1, task_count + 1):
+            for d in range(self.__levels):
+                counts[k][d:] += counts[k - 1][:s_max + 1 - d]
+        self.__cache[task_count] = counts
+        return counts
+
+    def sample(self, task_count: int, total: int, size: int, rng: np.random.Generator) -> ndarray:
+        # shift difficulties to 0 .. levels - 1 & check if the total can be reached
+        shifted = total - task_count * self.__low
+        if not (0 <= shifted <= task_count * (self.__levels - 1)):
+            raise ValueError(f"The total difficulty ({total}) is unreachable for {task_count} task(s).")
+        # choose every position of all vectors at once (proportionally to the amount of possible completions)
+        counts = self.__counts(task_count)
+        levels = np.arange(self.__levels)
+        remaining = np.full(size, shifted)
+        result = np.empty((size, task_count), dtype=np.int64)
+        for i in range(task_count):
+            rest = remaining[:, None] - levels[None, :]
+            weights = np.where(
+                rest >= 0, counts[task_count - i - 1][np.clip(rest, 0, counts.shape[1] - 1)], 0
+            )
+            cumulative = np.cumsum(weights, axis=1)
+            u = rng.random(size) * cumulative[:, -1]
+            result[:, i] = np.minimum((cumulative <= u[:, None]).sum(axis=1), self.__levels - 1)
+            remaining -= result[:, i]
+        return result + self.__low
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,128 @@
+from math import ceil
+from random import Random
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from main.services.docs.sampler import DifficultySampler
+
+# (!) this module must not import django: its functions are executed by the worker processes of the pool
+
+
+class QuestionBank:
+    """
+    ...
+    """
+
+    def __init__(self, difficulties: list[int]) -> None:
+        self.difficulties = difficulties
+        self.parts = []
+        self.__index = {}
+        self.__tasks = {}
+
+    def add_part(self, part: dict) -> None:
+        self.parts.append(part)
+
+    def add_task(self, part_id: int, position: int, task: dict) -> None:
+        self.__index.setdefault((part_id, position, task["difficulty"]), []).append(task)
+        self.__tasks[task["id"]] = task
+
+    def tasks(self, part_id: int, position: int, difficulty: int = None) -> list[dict]:
+        if difficulty is not None:
+            return self.__index.get((part_id, position, difficulty), [])
+        return [t for d in self.difficulties for t in self.__index.get((part_id, position, d), [])]
+
+    def task(self, task_id: int) -> dict:
+        return self.__tasks[task_id]
+
+
+class VariantBuilder:
+    """
+    ...
+    """
+
+    def __init__(self, bank: QuestionBank, seed: int = None) -> None:
+        self.__bank = bank
+        self.__rng = Random(seed)
+
+    def build(self, unique_key: str, distributions: dict[int, list[int]]) -> dict:
+        # (!) tasks & options are referenced by their IDs, the content is stored once per archive (see ArchiveData)
+        rng = self.__rng
+        # init result
+        result = []
+        # populate result with parts
+        for part in self.__bank.parts:
+            # get part's difficulty distribution
+            distribution = distributions[part["id"]]
+            # create part's material: [position, task ID, [option IDs]]
+            material = []
+            for position in range(1, part["task_count"] + 1):
+                tasks = self.__bank.tasks(part["id"], position)
+                if tasks:
+                    # choose task
+                    tasks_filtered = self.__bank.tasks(part["id"], position, distribution[position - 1])
+                    task = rng.choice(tasks_filtered) if tasks_filtered else rng.choice(tasks)
+                    # choose options
+                    options = []
+                    if part["answer_type"] == 0:
+                        wrong = [o for o in task["options"] if not o["is_answer"]]
+                        right = [o for o in task["options"] if o["is_answer"]]
+                        options = rng.sample(wrong, min(3, len(wrong))) + rng.sample(right, min(1, len(right)))
+                        rng.shuffle(options)
+                    elif part["answer_type"] == 1:
+                        options = [o for o in task["options"] if o["is_answer"]]
+                    # append material
+                    material.append([position, task["id"], [o["id"] for o in options]])
+            # add part's material to result
+            result.append({"id": part["id"], "material": material})
+        # return populated result
+        return {"unique_key": unique_key, "parts": result}
+
+
+# PARALLEL GENERATION ------------------------------------------------------------------------------------------------ #
+CHUNK_SIZE = 50  # variants per task of the pool (fixed, so the output doesn't depend on the number of workers)
+
+_worker_bank = None
+
+
+def _init_worker(bank: QuestionBank) -> None:
+    # receive the bank snapshot once per worker process
+    global _worker_bank
+    _worker_bank = bank
+
+
+def _build_chunk(unique_keys: list[str], distributions: dict, seed: int, bank: QuestionBank = None) -> list[dict]:
+    builder = VariantBuilder(bank if bank else _worker_bank, seed)
+    return [builder.build(uk, {k: v[i] for k, v in distributions.items()}) for i, uk in enumerate(unique_keys)]
+
+
+def build_variants(bank: QuestionBank, unique_keys: list[str], workers: int = 1, seed: int = None) -> list[dict]:
+    sequence_distributions, *sequence_chunks = np.random.SeedSequence(seed).spawn(
+        1 + ceil(len(unique_keys) / CHUNK_SIZE)
+    )
+    # sample difficulty distributions of every part for all variants of the pack at once
+    sampler = DifficultySampler(bank.difficulties)
+    generator = np.random.default_rng(sequence_distributions)
+    distributions = {
+        p["id"]: sampler.sample(p["task_count"], p["total_difficulty"], len(unique_keys), generator).tolist()
+        for p in bank.parts
+    }
+    # split keys & distributions into chunks, every chunk gets its own independent RNG stream
+    chunks = [unique_keys[i:i + CHUNK_SIZE] for i in range(0, len(unique_keys), CHUNK_SIZE)]
+    chunks_distributions = [
+        {k: v[i:i + CHUNK_SIZE] for k, v in distributions.items()} for i in range(0, len(unique_keys), CHUNK_SIZE)
+    ]
+    seeds = [int(s.generate_state(1, np.uint64)[0]) for s in sequence_chunks]
+    # build chunks sequentially or by the pool of processes (merged in the order of the chunks)
+    if workers <= 1 or len(chunks) <= 1:
+        results = [_build_chunk(c, d, s, bank) for c, d, s in zip(chunks, chunks_distributions, seeds)]
+    else:
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)), initializer=_init_worker, initargs=(bank,)
+        ) as executor:
+            results = list(executor.map(
+                _build_chunk, chunks, chunks_distributions, seeds, chunksize=ceil(len(chunks) / workers / 4)
+            ))
+    return [v for chunk in results for v in chunk]
+
+
+if __name__ == "__main__":
+    pass
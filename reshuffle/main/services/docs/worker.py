@@ -0,0 +1,121 @@
+from abc import ABC, abstractmethod
+from time import sleep
+from datetime import timedelta
+from threading import Thread, Event
+from django.db import models, transaction, connection, close_old_connections
+from django.utils import timezone
+from reshuffle.settings import JOB_HEARTBEAT, JOB_STALE_TIMEOUT
+from main.models import PackJob, ObjectStorageEntry
+from main.services.docs.factory import DocumentPackager
+
+
+class JobWorker(ABC):
+    """
+    ...
+    """
+
+    POLL_INTERVAL = 2  # seconds between checks of the job queue
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL) -> None:
+        self.__poll_interval = poll_interval
+
+    @property
+    @abstractmethod
+    def MODEL(self) -> type[models.Model]:
+        # model of the jobs of the queue (status: 0 queued, 1 running, 2 done, 3 failed)
+        ...
+
+    def claim(self):
+        # lock the oldest queued job (skip jobs locked by other workers) & mark it as running
+        with transaction.atomic():
+            job = self.MODEL.objects.select_for_update(skip_locked=True).filter(status=0).order_by("created").first()
+            if job:
+                job.status = 1
+                self.start(job)
+                job.save(update_fields=["status", "progress", "updated"])
+        return job
+
+    def fail_stale(self) -> None:
+        # jobs left running by crashed workers (no heartbeat) are failed, so their pollers stop waiting
+        deadline = timezone.now() - timedelta(seconds=JOB_STALE_TIMEOUT)
+        with transaction.atomic():
+            for job in self.MODEL.objects.select_for_update(skip_locked=True).filter(status=1, updated__lt=deadline):
+                self.fail(job, f"The worker stopped responding (no heartbeat for {JOB_STALE_TIMEOUT} s)")
+                job.save()
+
+    def start(self, job) -> None:
+        job.progress = {}
+
+    def fail(self, job, error: str) -> None:
+        job.error = error
+        job.status = 3
+
+    def keep_alive(self, job_id: int) -> Event:
+        # keep the job fresh while it runs (jobs can take longer than the stale timeout), set the event to stop
+        stop = Event()
+        Thread(target=self.__heartbeat, args=(job_id, stop), daemon=True).start()
+        return stop
+
+    def __heartbeat(self, job_id: int, stop: Event) -> None:
+        try:
+            while not stop.wait(JOB_HEARTBEAT):
+                self.MODEL.objects.filter(id=job_id, status=1).update(updated=timezone.now())
+        finally:
+            connection.close()
+
+    @abstractmethod
+    def run_job(self, job) -> None:
+        # build the claimed job & save its result (status: done or failed)
+        ...
+
+    def run(self, once: bool = False) -> None:
+        while True:
+            close_old_connections()
+            self.fail_stale()
+            job = self.claim()
+            if job:
+                self.run_job(job)
+            elif once:
+                return
+            else:
+                sleep(self.__poll_interval)
+
+
+class PackWorker(JobWorker):
+    """
+    ...
+    """
+
+    MODEL = PackJob
+
+    def start(self, job: PackJob) -> None:
+        job.progress = {k: PackJob.STAGE_STATES[0] for k in PackJob.STAGES.keys()}
+
+    def fail(self, job: PackJob, error: str) -> None:
+        for stage, state in job.progress.items():
+            if state == "running":
+                job.progress[stage] = "failed"
+        super().fail(job, error)
+
+    def run_job(self, job: PackJob) -> None:
+        packager = DocumentPackager(progress=job.set_stage)
+        stop = self.keep_alive(job.id)
+        try:
+            prefix = packager.pack(
+                user_id=job.user_id,
+                sbj_id=job.subject_id,
+                count=job.amount,
+                date=job.date.strftime("%d.%m.%Y")
+            )
+            job.archive = ObjectStorageEntry.objects.filter(prefix=prefix).first()
+            job.status = 2
+        except Exception as e:
+            self.fail(job, f"{type(e).__name__}: {e}")
+        finally:
+            stop.set()
+        job.stats = packager.stats
+        job.save()
+
+
+if __name__ == "__main__":
+    pass
@@ -1,11 +1,14 @@
 import re
 from math import ceil
+from typing import Container
 import numpy as np
 from numpy import ndarray
 import cv2
-import easyocr
 from main.models import Part
 from main.services.docs.factory import UniqueKey
+from reshuffle.settings import GLYPH_MIN_CONFIDENCE
+from main.services.ocr.service import LocalReader, RemoteReader, get_reader
+from main.services.ocr.glyphs import GlyphClassifier, segment_glyphs
 
 
 class Analyzer:
@@ -36,8 +39,11 @@ class Analyzer:
     __TYPE_1_ANSWERS_N = 2  # amount of answers for tasks with answer_type = 1 per one line
     __TYPE_1_ANSWERS_LEN = 13  # max length of answers for task with answer_type = 1
 
-    def __init__(self) -> None:
-        self.__reader = easyocr.Reader(["en", "ru"])
+    def __init__(self, reader: LocalReader | RemoteReader = None, glyphs: GlyphClassifier = None) -> None:
+        # (!) the reader loads models on the first use (or uses the shared OCR service)
+        self.__reader = reader if reader else get_reader()
+        # fields written one character per cell are read by the glyph classifier first (if it is trained)
+        self.__glyphs = glyphs if glyphs else GlyphClassifier.shared()
 
     def resize(self, img: ndarray, k: float) -> ndarray:
         (h, w) = img.shape[:2]
@@ -131,18 +137,61 @@ class Analyzer:
 
     def recognize(self, img: ndarray, box: ndarray | list, m: int = 0, allowlist: str = None) -> str:
         x, y, w, h, _ = box
-        result = self.__reader.readtext(img[y - m:y + h + m, x - m:x + w + m], detail=0, allowlist=allowlist)
+        result = self.__reader.readtext(img[y - m:y + h + m, x - m:x + w + m], allowlist=allowlist)
         return " ".join(result)
 
-    def check_mark(self, img: ndarray, box: ndarray, m: int = 0) -> bool:
+    def recognize_batch(self, crops: list[ndarray], allowlists: list[str | None]) -> list[str]:
+        # text of the whole crops (positions of the fields are known, so the detection is skipped)
+        if not crops:
+            return []
+        return [text.strip() for text in self.__reader.recognize_batch(crops, allowlists)]
+
+    def read_glyphs(self, cells: list[ndarray], allowlist: str = None) -> str | None:
+        # text of the cells by the glyph classifier (None if it isn't trained or isn't confident in any glyph)
+        if not cells or not self.__glyphs.trained:
+            return None
+        results = self.__glyphs.classify(cells, allowlist)
+        if min(confidence for _, confidence in results) < GLYPH_MIN_CONFIDENCE:
+            return None
+        return "".join(label for label, _ in results)
+
+    def fill_ratio(self, img: ndarray, box: ndarray, m: int = 0) -> float:
         x, y, w, h, area = box
         check_area = img[y - m:y + h + m, x - m:x + w + m]
         check_area = self.invert(check_area)
         enhanced = self.dilate(check_area, iterations=2)
         filled = cv2.countNonZero(enhanced)
-        return filled / area >= self.__FILLED_PERCENTAGE
+        return filled / area
+
+    def fill_ratios(self, img: ndarray, boxes: ndarray, m: int = 0) -> ndarray:
+        # fill ratios of all boxes at once (the same as fill_ratio of every box while the boxes are > 4px apart)
+        boxes = np.asarray(boxes).reshape((-1, 5))
+        if not len(boxes):
+            return np.empty((0,), dtype=float)
+        x0, y0 = boxes[:, 0] - m, boxes[:, 1] - m
+        x1, y1 = boxes[:, 0] + boxes[:, 2] + m, boxes[:, 1] + boxes[:, 3] + m
+        # only the region of the boxes is processed
+        left, top = x0.min(), y0.min()
+        img = img[top:y1.max(), left:x1.max()]
+        x0, x1, y0, y1 = x0 - left, x1 - left, y0 - top, y1 - top
+        # ink of the boxes only, so the lines around the boxes don't leak in by the dilation
+        inverted = self.invert(img)
+        ink = np.zeros_like(inverted)
+        for i in range(len(boxes)):
+            ink[y0[i]:y1[i], x0[i]:x1[i]] = inverted[y0[i]:y1[i], x0[i]:x1[i]]
+        # one dilated image & its integral image: filled area of every box by 4 lookups (vectorized)
+        enhanced = cv2.threshold(self.dilate(ink, iterations=2), 0, 1, cv2.THRESH_BINARY)[1]
+        integral = cv2.integral(enhanced)
+        filled = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        return filled / boxes[:, 4]
+
+    def check_mark(self, img: ndarray, box: ndarray, m: int = 0) -> bool:
+        return self.fill_ratio(img, box, m) >= self.__FILLED_PERCENTAGE
 
-    def get_unique_key(self, img: ndarray, stats: ndarray, data: dict) -> str | None:
+    def check_marks(self, img: ndarray, boxes: ndarray, m: int = 0) -> ndarray:
+        return self.fill_ratios(img, boxes, m) >= self.__FILLED_PERCENTAGE
+
+    def read_unique_key(self, img: ndarray, stats: ndarray, unique_keys: Container[str]) -> str:
         # calc w_max & tolerance
         stats = stats[2:]
         w_max = max(stats[:, 2])
@@ -157,31 +206,51 @@ class Analyzer:
         box = stats[stats[:, 1].argsort()][0]
         # detect text
         x, y, w, h, _ = box
+        # glyphs of the printed key (the last word of the box), EasyOCR if they aren't confident or the key isn't issued
+        unique_key = self.read_glyphs(segment_glyphs(img[y:y + h, x:x + w]), UniqueKey.BASE)
+        if unique_key and unique_key in unique_keys:
+            return unique_key
         unique_key = self.recognize(img=img, box=box, allowlist=UniqueKey.BASE)
-        unique_key = unique_key.split(" ")[-1].strip()
-        # check if detected text in data["variants"] & return result
-        if unique_key in [item["unique_key"] for item in data["variants"]]:
+        return unique_key.split(" ")[-1].strip()
+
+    def get_unique_key(self, img: ndarray, stats: ndarray, unique_keys: Container[str]) -> str | None:
+        unique_key = self.read_unique_key(img, stats, unique_keys)
+        # check if detected text in unique keys of the archive & return result
+        if unique_key in unique_keys:
             return unique_key
         return None
 
-    def get_fields(self, img: ndarray, stats: ndarray, variant: dict) -> tuple[dict, ndarray]:
+    @staticmethod
+    def correction_allowlist() -> str:
+        # (!) titles of the parts are translated, so the allowlist is built on every call
+        return "0123456789" + "".join([str(t) for t in list(Part.TITLES.values())])
+
+    def filter_checkboxes(self, stats: ndarray) -> ndarray:
         # filter stats for checkboxes only
         stats = stats[2:]
-        stats = stats[np.isclose(
+        return stats[np.isclose(
             stats[:, 2] / stats[:, 3], self.__CHECKBOX_W / self.__CHECKBOX_H, atol=self.__CHECKBOX_ATOL
         )]
-        # calc tolerance
+
+    def row_tolerance(self, stats: ndarray) -> int:
+        # same line = line +- tolerance (by the size of the first checkbox)
         _, _, w, h, _ = stats[0]
-        tolerance = round((w + h) / 2 * self.__TOLERANCE_PERCENTAGE)
-        # categorize checkboxes
-        y_set = set(stats[:, 1])
-        y_max = max(y_set)
-        checkboxes_correction = stats[np.isclose(stats[:, 1], y_max, atol=tolerance)]
-        y_set = y_set - set(checkboxes_correction[:, 1])
-        y_max = max(y_set)
-        checkboxes_answers = stats[stats[:, 1] <= y_max]
+        return round((w + h) / 2 * self.__TOLERANCE_PERCENTAGE)
+
+    def cluster_rows(self, stats: ndarray, tolerance: float) -> list[ndarray]:
+        # rows of the boxes (top to bottom) in one pass: sorted by y & split on the gaps > tolerance, sorted by x
+        stats = stats[stats[:, 1].argsort(kind="stable")]
+        rows = np.split(stats, np.flatnonzero(np.diff(stats[:, 1]) > tolerance) + 1)
+        return [row[row[:, 0].argsort(kind="stable")] for row in rows if len(row)]
+
+    def get_fields(self, img: ndarray, stats: ndarray, variant: dict) -> tuple[dict, ndarray]:
+        stats = self.filter_checkboxes(stats)
+        # calc tolerance
+        tolerance = self.row_tolerance(stats)
+        # categorize checkboxes: the last row is the correction field, rows above are read by position
+        rows = self.cluster_rows(stats, tolerance)
+        checkboxes_correction, rows_answers = rows[-1], rows[:-1]
         # create fields_correction [ndarray]
-        checkboxes_correction = checkboxes_correction[checkboxes_correction[:, 0].argsort()]
         checkboxes_correction[:, 3] = max(checkboxes_correction[:, 3])
         checkboxes_correction = checkboxes_correction.reshape(
             (self.__CHECKBOX_CORRECTION_N // self.__CHECKBOX_CORRECTION_LEN, self.__CHECKBOX_CORRECTION_LEN, 5)
@@ -190,18 +259,24 @@ class Analyzer:
             (self.__CHECKBOX_CORRECTION_N // self.__CHECKBOX_CORRECTION_LEN,),
             dtype=f"<U{self.__CHECKBOX_CORRECTION_LEN}"
         )
+        # (!) crops of all text fields are collected & recognized by one call: (crop, allowlist, field array, index)
+        crops = []
         m = 1
-        allowlist = "0123456789" + "".join([str(t) for t in list(Part.TITLES.values())])
+        allowlist = self.correction_allowlist()
         for i, box in enumerate(checkboxes_correction):
+            text = self.read_glyphs([img[y:y + h, x:x + w] for (x, y, w, h, _) in box], allowlist)
+            if text is not None:
+                fields_correction[i] = text
+                continue
             cut_area = np.concatenate(
                 [img[y - m:y + h + m, x - m:x + w + m] for (x, y, w, h, _) in box], axis=1
             )
-            fields_correction[i] = self.recognize(
-                img=cut_area, box=[0, 0, cut_area.shape[1], cut_area.shape[0], _], allowlist=allowlist
-            )
+            crops.append((cut_area, allowlist, fields_correction, i))
         # create fields_answers [dict]
+        # (!) checkboxes of all parts are collected & checked at once: (box, field array, row, column)
+        checkboxes = []
         fields_answers = {}
-        y_set = set(checkboxes_answers[:, 1])
+        r = 0  # position of the next row of the answers
         for part in variant["parts"]:
             # get part info
             title = part["info"]["title"]
@@ -214,29 +289,21 @@ class Analyzer:
                 n = ceil(task_count / Part.CAPACITIES[0])
                 k = -1
                 for i in range(self.__TYPE_0_ANSWERS_N * n):
-                    y_min = min(y_set)
                     if i % self.__TYPE_0_ANSWERS_N == 0:
                         k += 1
-                    checkboxes_answers_row = checkboxes_answers[
-                        np.isclose(checkboxes_answers[:, 1], y_min, atol=tolerance)
-                    ]
-                    checkboxes_answers_row = checkboxes_answers_row[checkboxes_answers_row[:, 0].argsort()]
-                    y_set = y_set - set(checkboxes_answers_row[:, 1])
+                    checkboxes_answers_row = rows_answers[r]
+                    r += 1
                     for j in range(len(checkboxes_answers_row)):
                         new_i = i % self.__TYPE_0_ANSWERS_N
                         new_j = j + k * Part.CAPACITIES[0]
-                        part_answers[new_i][new_j] = self.check_mark(img, checkboxes_answers_row[j])
+                        checkboxes.append((checkboxes_answers_row[j], part_answers, new_i, new_j))
                 fields_answers[title] = {"answer_type": answer_type, "material": part_answers.T}
             elif answer_type == 1:
                 # if tasks with short answer writing [1]
                 part_answers = np.empty((task_count,), dtype=f"<U{self.__TYPE_1_ANSWERS_LEN}")
                 for i in range(ceil(task_count / self.__TYPE_1_ANSWERS_N)):
-                    y_min = min(y_set)
-                    checkboxes_answers_row = checkboxes_answers[
-                        np.isclose(checkboxes_answers[:, 1], y_min, atol=tolerance)
-                    ]
-                    checkboxes_answers_row = checkboxes_answers_row[checkboxes_answers_row[:, 0].argsort()]
-                    y_set = y_set - set(checkboxes_answers_row[:, 1])
+                    checkboxes_answers_row = rows_answers[r]
+                    r += 1
                     splitted_row = checkboxes_answers_row.reshape(
                         (self.__TYPE_1_ANSWERS_N, self.__TYPE_1_ANSWERS_LEN, 5)
                     )
@@ -253,15 +320,44 @@ class Analyzer:
                                     re.compile("<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});"), "", o["content"]
                                 )
                                 allowlist += "".join({*clean})
-                        part_answers[i * self.__TYPE_1_ANSWERS_N + j] = self.recognize(
-                            img=cut_area,
-                            box=[0, 0, cut_area.shape[1], cut_area.shape[0], _],
-                            allowlist=allowlist if allowlist else None  # <-- TODO: create more complex allowlist(s)
-                        )
+                        crops.append((
+                            cut_area,
+                            allowlist if allowlist else None,  # <-- TODO: create more complex allowlist(s)
+                            part_answers,
+                            i * self.__TYPE_1_ANSWERS_N + j
+                        ))
                 fields_answers[title] = {"answer_type": answer_type, "material": part_answers}
+        # check marks of the checkboxes
+        marks = self.check_marks(img, np.array([c[0] for c in checkboxes]))
+        for (_, field, i, j), mark in zip(checkboxes, marks):
+            field[i][j] = mark
+        # recognize text fields
+        texts = self.recognize_batch([c[0] for c in crops], [c[1] for c in crops])
+        for (_, _, field, i), text in zip(crops, texts):
+            field[i] = text
         # return result
         return fields_answers, fields_correction
 
+    def fields_to_json(self, fields_answers: dict, fields_correction: ndarray) -> dict:
+        # recognized fields in JSON-compatible form (restored by fields_from_json)
+        return {
+            "answers": {
+                k: {"answer_type": v["answer_type"], "material": v["material"].tolist()}
+                for k, v in fields_answers.items()
+            },
+            "correction": fields_correction.tolist()
+        }
+
+    def fields_from_json(self, data: dict) -> tuple[dict, ndarray]:
+        fields_answers = {
+            k: {
+                "answer_type": v["answer_type"],
+                "material": np.array(v["material"], dtype=bool if v["answer_type"] == 0 else np.str_)
+            } for k, v in data["answers"].items()
+        }
+        fields_correction = np.array(data["correction"], dtype=f"<U{self.__CHECKBOX_CORRECTION_LEN}")
+        return fields_answers, fields_correction
+
     def score(self, variant: dict, fields_answers: dict, fields_correction: ndarray) -> dict:
         # apply corrections
         for k in fields_answers.keys():
@@ -0,0 +1,159 @@
+import os
+import logging
+from threading import Lock
+import numpy as np
+from numpy import ndarray
+import cv2
+from reshuffle.settings import GLYPH_MODEL, GLYPH_NEIGHBOURS
+
+logger = logging.getLogger(__name__)
+
+
+class GlyphClassifier:
+    """
+    ...
+    """
+
+    SIZE = 16  # side of the normalized bitmap of a glyph (px)
+    INK_THRESHOLD = 128  # pixels darker than the threshold are ink
+    EMPTY_PERCENTAGE = 0.02  # if ink area / cell area < EMPTY_PERCENTAGE -> cell is empty
+    EMPTY = ""  # label of empty cells
+
+    __shared = None
+    __shared_lock = Lock()
+
+    def __init__(self, k: int = GLYPH_NEIGHBOURS) -> None:
+        self.k = k
+        self.__x = np.empty((0, self.SIZE * self.SIZE), dtype=np.float32)  # normalized bitmaps of the samples
+        self.__y = np.empty((0,), dtype=np.str_)  # labels of the samples
+
+    @classmethod
+    def shared(cls, path: str = GLYPH_MODEL) -> "GlyphClassifier":
+        # one model per process (untrained if the model file doesn't exist)
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                classifier = cls()
+                if path and os.path.exists(path):
+                    classifier.load(path)
+                    logger.info(f"Glyph model is loaded: {len(classifier)} sample(s) of {classifier.labels}")
+                cls.__shared = classifier
+            return cls.__shared
+
+    @property
+    def trained(self) -> bool:
+        return len(self.__y) > 0
+
+    @property
+    def labels(self) -> str:
+        return "".join(sorted(set(self.__y)))
+
+    def normalize(self, img: ndarray) -> ndarray | None:
+        # ink of the cell cropped to its bounding box & scaled (keeping the aspect ratio) to the center of SIZE x SIZE
+        ink = (img < self.INK_THRESHOLD).astype(np.uint8)
+        if ink.sum() < ink.size * self.EMPTY_PERCENTAGE:
+            return None
+        ys, xs = np.nonzero(ink)
+        ink = ink[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+        h, w = ink.shape
+        k = (self.SIZE - 2) / max(h, w)
+        resized = cv2.resize(
+            ink.astype(np.float32), (max(1, round(w * k)), max(1, round(h * k))), interpolation=cv2.INTER_AREA
+        )
+        bitmap = np.zeros((self.SIZE, self.SIZE), dtype=np.float32)
+        y = (self.SIZE - resized.shape[0]) // 2
+        x = (self.SIZE - resized.shape[1]) // 2
+        bitmap[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+        vector = bitmap.ravel()
+        return vector / np.linalg.norm(vector)
+
+    def train(self, imgs: list[ndarray], labels: list[str]) -> int:
+        # samples are added to the model (empty crops are skipped), return amount of added samples
+        vectors = [(self.normalize(img), label) for img, label in zip(imgs, labels)]
+        vectors = [(v, label) for v, label in vectors if v is not None]
+        if vectors:
+            self.__x = np.vstack([self.__x] + [v for v, _ in vectors]).astype(np.float32)
+            self.__y = np.concatenate([self.__y, np.array([label for _, label in vectors])])
+        return len(vectors)
+
+    def classify(self, imgs: list[ndarray], allowlist: str = None) -> list[tuple[str, float]]:
+        # (label, confidence) of every image: votes of the k nearest samples (cosine similarity) of the allowed labels
+        results = [(self.EMPTY, 1.0)] * len(imgs)
+        vectors = [self.normalize(img) for img in imgs]
+        indexes = [i for i, v in enumerate(vectors) if v is not None]
+        if not indexes:
+            return results
+        x, y = self.__x, self.__y
+        if allowlist is not None:
+            allowed = np.isin(y, list(allowlist))
+            x, y = x[allowed], y[allowed]
+        if not len(y):
+            for i in indexes:
+                results[i] = (self.EMPTY, 0.0)
+            return results
+        k = min(self.k, len(y))
+        similarity = np.vstack([vectors[i] for i in indexes]) @ x.T
+        neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        for i, row in zip(indexes, neighbours):
+            labels, votes = np.unique(y[row], return_counts=True)
+            results[i] = (str(labels[votes.argmax()]), float(votes.max() / k))
+        return results
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, x=self.__x, y=self.__y)
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self.__x = data["x"].astype(np.float32)
+            self.__y = data["y"]
+
+    def __len__(self) -> int:
+        return len(self.__y)
+
+
+def segment_glyphs(img: ndarray, gap: float = 0.5) -> list[ndarray]:
+    # crops of the glyphs of the last word of a printed line (connected components of the ink, sorted by x)
+    ink = (img < GlyphClassifier.INK_THRESHOLD).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    # skip the background, noise & borders of the box (components as high as the image)
+    h_img = img.shape[0]
+    boxes = [s for s in stats[1:] if s[4] > 2 and s[3] < h_img * 0.9]
+    if not boxes:
+        return []
+    h_max = max(b[3] for b in boxes)
+    boxes = sorted([b for b in boxes if b[3] >= h_max / 2], key=lambda b: b[0])
+    # words are split by the gaps wider than the part of the glyph height
+    word = [boxes[-1]]
+    for box in reversed(boxes[:-1]):
+        if word[0][0] - (box[0] + box[2]) > h_max * gap:
+            break
+        word.insert(0, box)
+    # touching glyphs (component much wider than the others) are split evenly
+    w_median = float(np.median([b[2] for b in word]))
+    crops = []
+    for x, y, w, h, _ in word:
+        n = max(1, round(w / w_median)) if w > w_median * 1.5 else 1
+        crops += [img[y:y + h, x + w * i // n:x + w * (i + 1) // n] for i in range(n)]
+    return crops
+
+
+def load_samples(path: str) -> tuple[list[ndarray], list[str]]:
+    # labelled crops of glyphs: <path>/<label>/<image> (grayscale)
+    imgs, labels = [], []
+    for label in sorted(os.listdir(path)):
+        folder = os.path.join(path, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            img = cv2.imdecode(np.fromfile(os.path.join(folder, name), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                logger.warning(f"Sample cannot be decoded: {label}/{name}")
+                continue
+            imgs.append(img)
+            labels.append(label)
+    return imgs, labels
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,305 @@
+import os
+import json
+import logging
+import zipfile
+from io import BytesIO
+from uuid import uuid4
+from typing import Iterator, Callable
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from minio.error import S3Error
+from django.db import connection
+from reshuffle.settings import ARCHIVE_CACHE_SIZE, INGEST_WORKERS
+from main.models import UniqueKeyEntry
+from main.services.docs.minio_client import MinioClient
+from main.services.docs.factory import GeneratorJSON
+from main.services.docs.archive import ArchiveData, ArchiveManifest, ArchiveCache
+from main.services.ocr.analyzer import Analyzer
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # (!) optional: without PyMuPDF batches of scans are accepted as ZIP archives of images only
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMAT = "png"
+INGEST_IMAGE_FORMATS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")  # images of the batch (ZIP archive)
+INGEST_PDF_DPI = 200  # resolution of the rendered pages of the batch (PDF)
+RECOGNITION_FORMAT = "json"  # recognition results of the image are stored next to it: {image alias}.json
+FOLDER_CAPTURED = "captured"
+
+# (!) the storage client is created on the first call (MinioClient.shared), the models of the reader on the first OCR
+analyzer = Analyzer()
+archive_cache = ArchiveCache(ARCHIVE_CACHE_SIZE)
+
+
+def get_archive_data(prefix: str) -> ArchiveData:
+    # parsed data.json of the archive (shared by the requests of the process, revalidated by ETag)
+    return archive_cache.get(MinioClient.shared(), f"{prefix}/{GeneratorJSON.OUTPUT_JSON}")
+
+
+def get_archive_keys(prefix: str) -> ArchiveManifest | ArchiveData:
+    # unique keys of the archive (archives without per-variant objects are read from data.json)
+    try:
+        return archive_cache.get(
+            MinioClient.shared(),
+            f"{prefix}/{GeneratorJSON.FOLDER_VARIANTS}/{GeneratorJSON.OUTPUT_MANIFEST}",
+            ArchiveManifest
+        )
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+        return get_archive_data(prefix)
+
+
+def get_archive_variant(prefix: str, unique_key: str) -> dict | None:
+    keys = get_archive_keys(prefix)
+    if isinstance(keys, ArchiveData):
+        return keys.variant(unique_key)
+    if unique_key not in keys:
+        return None
+    return json.loads(
+        MinioClient.shared().get_object_content(f"{prefix}/{GeneratorJSON.FOLDER_VARIANTS}/{unique_key}.json")
+    )
+
+
+def recognize_fields(img: np.ndarray, stats: np.ndarray, variant: dict) -> tuple[dict, np.ndarray] | None:
+    # OCR of the answer fields (None if the work cannot be recognized now, e.g. the OCR service is down)
+    try:
+        return analyzer.get_fields(img, stats, variant)
+    except Exception:
+        logger.exception("Fields of the work cannot be recognized")
+        return None
+
+
+def save_recognition(alias: str, unique_key: str | None, stats: np.ndarray, fields: tuple | None) -> None:
+    # store connected components & recognized fields of the image (alias) for the unique key
+    # (!) fields = None is not a result: the fields are recognized again when the work is scored
+    content = json.dumps({
+        "unique_key": unique_key,
+        "stats": stats.tolist(),
+        "fields": analyzer.fields_to_json(*fields) if fields else None
+    }).encode()
+    MinioClient.shared().upload_bytes(obj=BytesIO(content), alias=f"{alias}.{RECOGNITION_FORMAT}", length=len(content))
+
+
+def rename_recognition(alias_old: str, alias_new: str) -> None:
+    # move the recognition results with the image (images uploaded before have none)
+    try:
+        MinioClient.shared().rename_object(
+            alias_old=f"{alias_old}.{RECOGNITION_FORMAT}",
+            alias_new=f"{alias_new}.{RECOGNITION_FORMAT}"
+        )
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+
+
+def get_recognized_fields(alias: str, unique_key: str, variant: dict) -> tuple[dict, np.ndarray] | None:
+    # fields are recognized once (on upload) & stored next to the image
+    try:
+        recognition = json.loads(MinioClient.shared().get_object_content(f"{alias}.{RECOGNITION_FORMAT}"))
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+        recognition = None
+    if recognition and recognition["unique_key"] == unique_key and recognition["fields"]:
+        return analyzer.fields_from_json(recognition["fields"])
+    # images uploaded before, renamed to another unique key or not recognized on upload are recognized here
+    response = MinioClient.shared().get_object_content(alias=alias, decoded=False)
+    try:
+        img_data = response.data
+    finally:
+        response.close()
+        response.release_conn()
+    img_threshold = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img_threshold is None:
+        return None
+    if recognition:
+        stats = np.array(recognition["stats"], dtype=np.int32)
+    else:
+        stats = analyzer.calc_stats(img_threshold)
+    fields = recognize_fields(img_threshold, stats, variant)
+    if fields is not None or recognition is None or recognition["unique_key"] != unique_key:
+        save_recognition(alias, unique_key, stats, fields)
+    return fields
+
+
+class IssuedKeys:
+    """
+    ...
+    """
+
+    def __init__(self) -> None:
+        self.__entries = {}  # unique key: entry of the key (None: the key isn't issued by an archive)
+
+    def __contains__(self, unique_key: str) -> bool:
+        return self.get(unique_key) is not None
+
+    def get(self, unique_key: str) -> UniqueKeyEntry | None:
+        # (!) every key is looked up once: the analyzer checks the read key & the work is resolved by the same entry
+        if unique_key not in self.__entries:
+            self.__entries[unique_key] = UniqueKeyEntry.lookup(unique_key)
+        return self.__entries[unique_key]
+
+
+def read_work(img_base: np.ndarray, prefix: str = None) -> tuple[np.ndarray, np.ndarray, str | None, str | None]:
+    # processed image, stats, unique key & prefix of the work (prefix is None: the archive is not resolved)
+    img_grayscale = analyzer.grayscale(img_base)
+    img_restore_perspective = analyzer.restore_perspective(img_grayscale)
+    img_threshold = analyzer.threshold(img_restore_perspective)
+    stats = analyzer.calc_stats(img_threshold)
+    if prefix:
+        uk = analyzer.get_unique_key(img_threshold, stats, get_archive_keys(prefix))
+    else:
+        # resolve the archive by the unique key only (any key issued by an archive)
+        issued = IssuedKeys()
+        entry = issued.get(analyzer.read_unique_key(img_threshold, stats, issued))
+        uk, prefix = (entry.unique_key, entry.archive.prefix) if entry else (None, None)
+    return img_threshold, stats, uk, prefix
+
+
+def store_work(img_threshold: np.ndarray, stats: np.ndarray, uk: str | None, prefix: str) -> dict:
+    # save processed image to storage
+    _, buffer = cv2.imencode(f".{IMAGE_FORMAT}", img_threshold)
+    obj = BytesIO(buffer.tobytes())
+    name = uk if uk else str(uuid4())
+    MinioClient.shared().upload_bytes(
+        obj=obj,
+        alias=f"{prefix}/{FOLDER_CAPTURED}/{name}.{IMAGE_FORMAT}",
+        length=obj.getbuffer().nbytes
+    )
+    # recognize fields of the work once & save the results next to the image (used by Score)
+    fields = recognize_fields(img_threshold, stats, get_archive_variant(prefix, uk)) if uk else None
+    save_recognition(f"{prefix}/{FOLDER_CAPTURED}/{name}.{IMAGE_FORMAT}", uk, stats, fields)
+    return {"recognized": True, "unique_key": uk, "alias": name, "prefix": prefix}
+
+
+def process_work(img_base: np.ndarray, prefix: str = None) -> dict:
+    img_threshold, stats, uk, prefix = read_work(img_base, prefix)
+    if not prefix:
+        return {"recognized": False, "unique_key": None, "alias": None}
+    return store_work(img_threshold, stats, uk, prefix)
+
+
+def iter_scans(path: str) -> Iterator[tuple[str, bytes | np.ndarray]]:
+    # pages of the batch: images of the ZIP archive (encoded) or pages of the PDF (rendered), in order
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in INGEST_IMAGE_FORMATS:
+                    yield info.filename, archive.read(info)
+    else:
+        if not fitz:
+            raise ValueError("PDF files cannot be read: PyMuPDF is not installed (see requirements).")
+        with fitz.open(path) as document:
+            for page in document:
+                pixmap = page.get_pixmap(dpi=INGEST_PDF_DPI)
+                img = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR if pixmap.n == 3 else cv2.COLOR_GRAY2BGR)
+                yield f"{page.number + 1}", img
+
+
+def count_scans(path: str) -> int:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return sum(
+                not i.is_dir() and os.path.splitext(i.filename)[1].lower() in INGEST_IMAGE_FORMATS
+                for i in archive.infolist()
+            )
+    if not fitz:
+        raise ValueError("PDF files cannot be read: PyMuPDF is not installed (see requirements).")
+    with fitz.open(path) as document:
+        return document.page_count
+
+
+class StoredPages:
+    """
+    ...
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__keys = {}  # (prefix, unique key): [lock of the key, position of the stored page]
+
+    def store(self, key: tuple[str, str], position: int, write: Callable[[], dict]) -> dict | None:
+        # the image & recognition results of the work are written by one page at a time (None: a later page is kept)
+        with self.__lock:
+            entry = self.__keys.setdefault(key, [Lock(), -1])
+        with entry[0]:
+            if entry[1] > position:
+                return None
+            result = write()
+            entry[1] = position
+            return result
+
+
+def ingest_page(page: bytes | np.ndarray, position: int, stored: StoredPages, prefix: str = None) -> dict:
+    try:
+        if isinstance(page, bytes):
+            page = cv2.imdecode(np.frombuffer(page, np.uint8), cv2.IMREAD_COLOR)
+            if page is None:
+                raise ValueError("The image cannot be decoded.")
+        img_threshold, stats, uk, prefix = read_work(page, prefix)
+        if not prefix:
+            return {"recognized": False, "unique_key": None, "alias": None, "stored": False}
+        if not uk:
+            # (!) the archive is known but the key isn't matched: the image is stored under a uuid (renamed by hand)
+            return store_work(img_threshold, stats, uk, prefix) | {"recognized": False, "stored": True}
+        # (!) the same work may be scanned twice: the last page of the batch is kept whatever finishes first
+        result = stored.store((prefix, uk), position, lambda: store_work(img_threshold, stats, uk, prefix))
+        if result is None:
+            return {"recognized": True, "unique_key": uk, "alias": uk, "prefix": prefix, "stored": False}
+        return result | {"stored": True}
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e).strip()}"
+        return {"recognized": False, "unique_key": None, "alias": None, "stored": False, "error": error}
+    finally:
+        # (!) executed by the threads of the pool: their db connections are not closed by the request cycle
+        connection.close()
+
+
+def ingest_works(
+        path: str,
+        prefix: str = None,
+        workers: int = INGEST_WORKERS,
+        progress: Callable[[int], None] = None
+) -> list[dict]:
+    # process pages of the batch by the pool of threads (at most 2 pages per thread are decoded & waiting)
+    workers = max(1, workers)
+    stored = StoredPages()
+    results = []
+
+    def collect(page: dict, future) -> None:
+        results.append(page | future.result())
+        if progress:
+            progress(len(results))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for position, (name, page) in enumerate(iter_scans(path)):
+            if len(pending) >= 2 * workers:
+                collect(*pending.popleft())
+            pending.append(({"page": name}, executor.submit(ingest_page, page, position, stored, prefix)))
+        while pending:
+            collect(*pending.popleft())
+    # every page of the work points to the kept one (its image & recognition results are stored)
+    kept = {(r["prefix"], r["unique_key"]): r["page"] for r in results if r["stored"] and r["unique_key"]}
+    for r in results:
+        key = (r.get("prefix"), r["unique_key"])
+        r["kept"] = kept.get(key) if r["unique_key"] else None
+        r["duplicate"] = bool(r["unique_key"]) and r["kept"] != r["page"]
+    return results
+
+
+def is_readable(file) -> bool:
+    # ZIP archives are always accepted, PDF files only with PyMuPDF
+    return zipfile.is_zipfile(file) or fitz is not None
+
+
+if __name__ == "__main__":
+    pass
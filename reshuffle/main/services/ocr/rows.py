@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def legacy_rows(stats: np.ndarray, tolerance: float) -> list[np.ndarray]:
+    # rows of the checkboxes by the previous algorithm (the next row = boxes close to the min y left), reference only
+    y_set = set(stats[:, 1])
+    correction = stats[np.isclose(stats[:, 1], max(y_set), atol=tolerance)]
+    y_set = y_set - set(correction[:, 1])
+    answers = stats[stats[:, 1] <= max(y_set)]
+    rows = []
+    y_set = set(answers[:, 1])
+    while y_set:
+        row = answers[np.isclose(answers[:, 1], min(y_set), atol=tolerance)]
+        row = row[row[:, 0].argsort()]
+        y_set = y_set - set(row[:, 1])
+        rows.append(row)
+    return rows + [correction[correction[:, 0].argsort()]]
+
+
+if __name__ == "__main__":
+    pass
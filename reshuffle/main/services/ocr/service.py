@@ -0,0 +1,266 @@
+import os
+import logging
+from time import monotonic
+from queue import Queue, Empty
+from typing import Callable
+from threading import Thread, Lock, Event, local
+from multiprocessing.connection import Listener, Client, Connection
+import numpy as np
+from numpy import ndarray
+from reshuffle.settings import SECRET_KEY, OCR_SOCKET, OCR_BATCH_SIZE, OCR_BATCH_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class LocalReader:
+    """
+    ...
+    """
+
+    LANGUAGES = ["en", "ru"]
+
+    def __init__(self) -> None:
+        self.__reader = None
+        self.__lock = Lock()
+
+    @property
+    def reader(self):
+        # (!) models are loaded on the first call: processes, which don't recognize anything, stay small
+        with self.__lock:
+            if self.__reader is None:
+                import easyocr
+                self.__reader = easyocr.Reader(self.LANGUAGES)
+            return self.__reader
+
+    def readtext(self, img: ndarray, allowlist: str = None) -> list[str]:
+        return self.reader.readtext(img, detail=0, allowlist=allowlist)
+
+    def readtext_batch(self, imgs: list[ndarray], allowlist: str = None) -> list[list[str]]:
+        # images of the batch are padded (white background) to the same size & the text is detected at once
+        if len(imgs) == 1:
+            return [self.readtext(imgs[0], allowlist)]
+        h = max(img.shape[0] for img in imgs)
+        w = max(img.shape[1] for img in imgs)
+        padded = []
+        for img in imgs:
+            canvas = np.full((h, w) + img.shape[2:], 255, dtype=img.dtype)
+            canvas[:img.shape[0], :img.shape[1]] = img
+            padded.append(canvas)
+        return self.reader.readtext_batched(padded, batch_size=len(padded), allowlist=allowlist, detail=0)
+
+    def recognize_batch(self, imgs: list[ndarray], allowlists: list[str | None]) -> list[str]:
+        # text of every whole image (detection is skipped)
+        # (!) the crops are passed as they are: EasyOCR recognizes the boxes of one image one by one on CPU anyway
+        results = []
+        for img, allowlist in zip(imgs, allowlists):
+            h, w = img.shape[:2]
+            text = self.reader.recognize(
+                img, horizontal_list=[[0, w, 0, h]], free_list=[], allowlist=allowlist, detail=0
+            )
+            results.append(" ".join(text))
+        return results
+
+
+class RemoteReader:
+    """
+    ...
+    """
+
+    def __init__(self, address: str = OCR_SOCKET) -> None:
+        self.__address = address
+        self.__local = local()  # connection of the thread (requests of one connection are answered in order)
+
+    def __connection(self) -> Connection:
+        if getattr(self.__local, "connection", None) is None:
+            self.__local.connection = Client(self.__address, family="AF_UNIX", authkey=SECRET_KEY.encode())
+        return self.__local.connection
+
+    def __call(self, method: str, *args) -> list:
+        # reconnect once if the service was restarted
+        for attempt in range(2):
+            try:
+                connection = self.__connection()
+                connection.send((method, args))
+                result, error = connection.recv()
+                break
+            except (OSError, EOFError):
+                self.__local.connection = None
+                if attempt:
+                    raise
+        if error:
+            raise RuntimeError(f"OCR service: {error}")
+        return result
+
+    def readtext(self, img: ndarray, allowlist: str = None) -> list[str]:
+        return self.__call("readtext", img, allowlist)
+
+    def recognize_batch(self, imgs: list[ndarray], allowlists: list[str | None]) -> list[str]:
+        return self.__call("recognize_batch", imgs, allowlists)
+
+
+class OCRService:
+    """
+    ...
+    """
+
+    METHODS = ("readtext", "recognize_batch")
+
+    def __init__(self, address: str = OCR_SOCKET, batch_size: int = OCR_BATCH_SIZE,
+                 batch_wait: float = OCR_BATCH_WAIT) -> None:
+        self.__address = address
+        self.__batch_size = batch_size
+        self.__batch_wait = batch_wait
+        self.__reader = LocalReader()
+        self.__requests = Queue()  # [method, args, event, (result, error)] of all connections
+        self.__carried = None  # request which didn't fit into the previous batch
+        self.batches = 0
+        self.images = 0
+
+    def __handle(self, connection: Connection) -> None:
+        # one connection per thread of the client
+        try:
+            while True:
+                message = connection.recv()
+                error = self.__validate(message)
+                if error:
+                    # (!) malformed requests are answered here: they never reach the batches of other clients
+                    connection.send((None, error))
+                    continue
+                method, args = message
+                request = [method, args, Event(), None]
+                self.__requests.put(request)
+                request[2].wait()
+                connection.send(request[3])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    @staticmethod
+    def __validate(message) -> str | None:
+        # error of the malformed request (None: the request is valid)
+        if not isinstance(message, tuple) or len(message) != 2 or not isinstance(message[1], tuple):
+            return "Malformed request: (method, args) is expected"
+        method, args = message
+        if method not in OCRService.METHODS:
+            return f"Unknown method: {method}"
+        is_allowlist = lambda a: a is None or isinstance(a, str)
+        if method == "readtext":
+            if len(args) != 2 or not isinstance(args[0], ndarray) or not is_allowlist(args[1]):
+                return "readtext: (image, allowlist) is expected"
+        else:
+            if (
+                len(args) != 2
+                or not isinstance(args[0], list)
+                or not isinstance(args[1], list)
+                or len(args[0]) != len(args[1])
+                or not all(isinstance(img, ndarray) for img in args[0])
+                or not all(is_allowlist(a) for a in args[1])
+            ):
+                return "recognize_batch: (images, allowlists) of the same length is expected"
+        return None
+
+    @staticmethod
+    def __size(request: list) -> int:
+        # images of the request
+        return 1 if request[0] == "readtext" else len(request[1][0])
+
+    def __collect(self) -> list[list]:
+        # wait for the first request, then for more requests until the batch is full (images) or the time is over
+        if self.__carried is not None:
+            batch, self.__carried = [self.__carried], None
+        else:
+            batch = [self.__requests.get()]
+        images = self.__size(batch[0])
+        deadline = monotonic() + self.__batch_wait
+        while images < self.__batch_size and (timeout := deadline - monotonic()) > 0:
+            try:
+                request = self.__requests.get(timeout=timeout)
+            except Empty:
+                break
+            if images + self.__size(request) > self.__batch_size:
+                # (!) the request is kept whole: it starts the next batch
+                self.__carried = request
+                break
+            batch.append(request)
+            images += self.__size(request)
+        return batch
+
+    def __run(self, requests: list[list], images: int, call: Callable[[], list]) -> None:
+        # call returns results of the requests (in the same order)
+        try:
+            for request, result in zip(requests, call()):
+                request[3] = (result, None)
+        except Exception as e:
+            logger.exception("Batch cannot be recognized")
+            for request in requests:
+                request[3] = (None, f"{type(e).__name__}: {e}")
+        self.batches += 1
+        self.images += images
+        for request in requests:
+            request[2].set()
+
+    def __readtext(self, requests: list[list], allowlist: str | None) -> list:
+        return self.__reader.readtext_batch([r[1][0] for r in requests], allowlist)
+
+    def __recognize(self, requests: list[list]) -> list:
+        # crops of all requests are recognized by one call & split back by the requests
+        results = self.__reader.recognize_batch(
+            [img for r in requests for img in r[1][0]], [a for r in requests for a in r[1][1]]
+        )
+        split = []
+        for request in requests:
+            split.append(results[:len(request[1][0])])
+            results = results[len(request[1][0]):]
+        return split
+
+    def __infer(self) -> None:
+        while True:
+            batch = self.__collect()
+            try:
+                # images of one readtext call must have the same allowlist (recognize_batch groups them itself)
+                groups = {}
+                recognize = []
+                for request in batch:
+                    if request[0] == "readtext":
+                        groups.setdefault(request[1][1], []).append(request)
+                    else:
+                        recognize.append(request)
+                for allowlist, requests in groups.items():
+                    self.__run(requests, len(requests), lambda: self.__readtext(requests, allowlist))
+                if recognize:
+                    self.__run(recognize, sum(len(r[1][0]) for r in recognize), lambda: self.__recognize(recognize))
+            except Exception as e:
+                # (!) the thread serves all clients: the requests of the batch fail, the service keeps running
+                logger.exception("Batch cannot be processed")
+                for request in batch:
+                    if not request[2].is_set():
+                        request[3] = (None, f"{type(e).__name__}: {e}")
+                        request[2].set()
+
+    def serve(self) -> None:
+        # load the models before the socket is opened, so the clients don't wait for them
+        self.__reader.reader
+        if os.path.exists(self.__address):
+            os.remove(self.__address)
+        with Listener(self.__address, family="AF_UNIX", authkey=SECRET_KEY.encode()) as listener:
+            os.chmod(self.__address, 0o660)
+            Thread(target=self.__infer, daemon=True).start()
+            logger.info(f"OCR service is listening on {self.__address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    # failed authentication of a client
+                    logger.warning(f"Connection is rejected: {e}")
+                    continue
+                Thread(target=self.__handle, args=(connection,), daemon=True).start()
+
+
+def get_reader() -> LocalReader | RemoteReader:
+    # shared OCR service (if configured) or models of the process
+    return RemoteReader(OCR_SOCKET) if OCR_SOCKET else LocalReader()
+
+
+if __name__ == "__main__":
+    pass
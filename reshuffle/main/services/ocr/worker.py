@@ -0,0 +1,44 @@
+import os
+from main.models import IngestJob
+from main.services.docs.worker import JobWorker
+from main.services.ocr.ingest import ingest_works, count_scans
+
+
+class IngestWorker(JobWorker):
+    """
+    ...
+    """
+
+    MODEL = IngestJob
+
+    def fail(self, job: IngestJob, error: str) -> None:
+        super().fail(job, error)
+        self.__discard(job)
+
+    def run_job(self, job: IngestJob) -> None:
+        stop = self.keep_alive(job.id)
+        try:
+            total = count_scans(job.path)
+            job.set_progress(0, total)
+            job.manifest = ingest_works(
+                job.path,
+                job.prefix if job.prefix else None,
+                progress=lambda done: job.set_progress(done, total)
+            )
+            job.status = 2
+            self.__discard(job)
+        except Exception as e:
+            self.fail(job, f"{type(e).__name__}: {e}")
+        finally:
+            stop.set()
+        job.save()
+
+    @staticmethod
+    def __discard(job: IngestJob) -> None:
+        # the uploaded file is not needed once the batch is processed (or the job failed)
+        if os.path.exists(job.path):
+            os.remove(job.path)
+
+
+if __name__ == "__main__":
+    pass
@@ -1 +1,306 @@
-from django.test import TestCase
+import os
+import json
+from tempfile import TemporaryDirectory
+from collections import Counter
+from itertools import product
+import numpy as np
+import cv2
+from django.test import SimpleTestCase
+from main.services.docs.sampler import DifficultySampler
+from main.services.docs.archive import ArchiveData, ArchiveManifest
+from main.services.docs.factory import UniqueKey
+from main.services.ocr.glyphs import GlyphClassifier, segment_glyphs
+from main.services.ocr.analyzer import Analyzer
+from main.services.ocr.rows import legacy_rows
+
+
+class DifficultySamplerTests(SimpleTestCase):
+    def test_sums_and_bounds(self):
+        sampler = DifficultySampler([1, 2, 3])
+        sample = sampler.sample(12, 25, 500, np.random.default_rng(0))
+        self.assertEqual(sample.shape, (500, 12))
+        self.assertTrue((sample.sum(axis=1) == 25).all())
+        self.assertEqual((sample.min(), sample.max()), (1, 3))
+
+    def test_extreme_totals(self):
+        sampler = DifficultySampler([0, 1, 2])
+        self.assertTrue((sampler.sample(5, 0, 10, np.random.default_rng(0)) == 0).all())
+        self.assertTrue((sampler.sample(5, 10, 10, np.random.default_rng(0)) == 2).all())
+
+    def test_uniform(self):
+        # every distribution with the total is equally likely
+        sampler = DifficultySampler([0, 1, 2])
+        expected = [v for v in product(range(3), repeat=4) if sum(v) == 4]
+        size = 2000 * len(expected)
+        counts = Counter(map(tuple, sampler.sample(4, 4, size, np.random.default_rng(1)).tolist()))
+        self.assertEqual(set(counts), set(expected))
+        for v in expected:
+            self.assertAlmostEqual(counts[v] / size, 1 / len(expected), delta=0.2 / len(expected))
+
+    def test_unreachable_total(self):
+        sampler = DifficultySampler([0, 1, 2])
+        with self.assertRaises(ValueError):
+            sampler.sample(5, 11, 1, np.random.default_rng(0))
+        with self.assertRaises(ValueError):
+            DifficultySampler([1, 2, 3]).sample(5, 4, 1, np.random.default_rng(0))
+
+    def test_reproducible(self):
+        sampler = DifficultySampler([0, 1, 2])
+        a = sampler.sample(20, 17, 50, np.random.default_rng(7))
+        b = DifficultySampler([0, 1, 2]).sample(20, 17, 50, np.random.default_rng(7))
+        self.assertTrue((a == b).all())
+
+
+def archive_data(version: int = 2) -> dict:
+    # archive of 2 variants: part A (answer choice) & part B (short answer)
+    parts = {
+        "1": {"id": 1, "title": "A", "answer_type": 0, "task_count": 2, "difficulty_total": 2, "inst_content": "a"},
+        "2": {"id": 2, "title": "B", "answer_type": 1, "task_count": 1, "difficulty_total": 1, "inst_content": "b"},
+    }
+    tasks = {"10": {"content": "t10", "difficulty": 0}, "11": {"content": "t11", "difficulty": 2},
+             "20": {"content": "t20", "difficulty": 1, "updated": "2024-01-01"}}
+    options = {"100": {"content": "o100", "is_answer": False}, "101": {"content": "o101", "is_answer": True},
+               "110": {"content": "o110", "is_answer": True}, "200": {"content": "42", "is_answer": True}}
+    variants = [
+        {"unique_key": "AAA", "parts": [{"id": 1, "material": [[1, 10, [101, 100]], [2, 11, [110]]]},
+                                        {"id": 2, "material": [[1, 20, [200]]]}]},
+        {"unique_key": "BBB", "parts": [{"id": 1, "material": [[1, 10, [100, 101]], [2, 11, [110]]]},
+                                        {"id": 2, "material": [[1, 20, [200]]]}]},
+    ]
+    data = {"version": 2, "subject": {"title": "S"}, "date": "01.01.2024", "doc_header": "h", "parts": parts,
+            "tasks": tasks, "options": options, "variants": variants}
+    if version == 1:
+        data = {**data, "version": 1, "variants": [ArchiveData(data).variant(v["unique_key"]) for v in variants]}
+        for key in ("parts", "tasks", "options"):
+            data.pop(key)
+    return data
+
+
+class ArchiveDataTests(SimpleTestCase):
+    def test_expand(self):
+        data = ArchiveData(archive_data())
+        variant = data.variant("AAA")
+        self.assertEqual(variant["unique_key"], "AAA")
+        part_a, part_b = variant["parts"]
+        self.assertEqual(part_a["info"]["difficulty_generated"], 2)
+        self.assertEqual([t["position"] for t in part_a["material"]], ["A1", "A2"])
+        self.assertEqual([o["content"] for o in part_a["material"][0]["options"]], ["o101", "o100"])
+        self.assertEqual(part_b["material"][0]["updated"], "2024-01-01")
+        self.assertIsNone(data.variant("CCC"))
+
+    def test_versions_are_equivalent(self):
+        v2 = ArchiveData(archive_data(2))
+        v1 = ArchiveData(json.loads(json.dumps(archive_data(1))))
+        self.assertEqual(v1.version, 1)
+        self.assertEqual(v1.unique_keys(), v2.unique_keys())
+        self.assertEqual(v1.parts(), v2.parts())
+        self.assertEqual(list(v1), list(v2))
+        self.assertNotIn("difficulty_generated", v2.parts()[0])
+
+    def test_variant_is_a_copy(self):
+        data = ArchiveData(archive_data())
+        data.variant("AAA")["parts"][0]["material"].clear()
+        self.assertEqual(len(data.variant("AAA")["parts"][0]["material"]), 2)
+
+    def test_json_round_trip(self):
+        data = ArchiveData(json.loads(json.dumps(ArchiveData(archive_data()).raw)))
+        self.assertEqual(data.variant("BBB"), ArchiveData(archive_data()).variant("BBB"))
+        self.assertEqual(data.layout, ArchiveData.LAYOUT_SINGLE)
+        self.assertEqual(len(data), 2)
+        self.assertIn("BBB", data)
+
+    def test_manifest(self):
+        data = ArchiveData(archive_data())
+        manifest = ArchiveManifest(json.loads(json.dumps(data.manifest())))
+        self.assertEqual(manifest.unique_keys(), ["AAA", "BBB"])
+        self.assertIn("AAA", manifest)
+        self.assertNotIn("CCC", manifest)
+        self.assertEqual(len(manifest), 2)
+
+
+class UniqueKeyTests(SimpleTestCase):
+    def test_decode(self):
+        uk = UniqueKey(3)
+        self.assertEqual(uk.decode(0), "AAA")
+        self.assertEqual(uk.decode(27), "ABB")
+        self.assertEqual(uk.decode(26 ** 3 - 1), "ZZZ")
+
+    def test_decode_is_bijective(self):
+        uk = UniqueKey(2)
+        keys = [uk.decode(n) for n in range(26 ** 2)]
+        self.assertEqual(len(set(keys)), 26 ** 2)
+        self.assertTrue(all(len(k) == 2 and set(k) <= set(UniqueKey.BASE) for k in keys))
+
+    def test_sample(self):
+        uk = UniqueKey(6)
+        keys = uk.sample(5000)
+        self.assertEqual(len(set(keys)), 5000)
+        self.assertTrue(all(len(k) == 6 and set(k) <= set(UniqueKey.BASE) for k in keys))
+
+    def test_sample_whole_space(self):
+        self.assertEqual(sorted(UniqueKey(2).sample(26 ** 2)), sorted(UniqueKey(2).decode(n) for n in range(26 ** 2)))
+        with self.assertRaises(ValueError):
+            UniqueKey(1).sample(27)
+
+
+def glyph(label: str, font: int = cv2.FONT_HERSHEY_SIMPLEX, scale: float = 1.0, shift: int = 0) -> np.ndarray:
+    # printed glyph on the white cell
+    img = np.full((40, 40), 255, np.uint8)
+    cv2.putText(img, label, (8 + shift, 30), font, scale, 0, 2)
+    return img
+
+
+class GlyphClassifierTests(SimpleTestCase):
+    LABELS = "ABC0123"
+
+    def classifier(self) -> GlyphClassifier:
+        classifier = GlyphClassifier(k=3)
+        for font, scale, shift in product([cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX], [0.9, 1.1], [-2, 2]):
+            classifier.train([glyph(label, font, scale, shift) for label in self.LABELS], list(self.LABELS))
+        return classifier
+
+    def test_train(self):
+        classifier = self.classifier()
+        self.assertTrue(classifier.trained)
+        self.assertEqual(classifier.labels, "0123ABC")
+        self.assertEqual(len(classifier), 8 * len(self.LABELS))
+        # empty crops aren't samples
+        self.assertEqual(classifier.train([np.full((40, 40), 255, np.uint8)], ["A"]), 0)
+
+    def test_classify(self):
+        results = self.classifier().classify([glyph(label) for label in self.LABELS])
+        self.assertEqual("".join(label for label, _ in results), self.LABELS)
+        self.assertTrue(all(confidence == 1.0 for _, confidence in results))
+
+    def test_empty_cells(self):
+        classifier = self.classifier()
+        results = classifier.classify([np.full((40, 40), 255, np.uint8), glyph("B")])
+        self.assertEqual(results, [(GlyphClassifier.EMPTY, 1.0), ("B", 1.0)])
+        self.assertEqual(GlyphClassifier().classify([glyph("A")]), [(GlyphClassifier.EMPTY, 0.0)])
+
+    def test_allowlist(self):
+        classifier = self.classifier()
+        self.assertTrue(all(label in "0123" for label, _ in classifier.classify([glyph("B"), glyph("C")], "0123")))
+        self.assertEqual(classifier.classify([glyph("A")], "XYZ"), [(GlyphClassifier.EMPTY, 0.0)])
+
+    def test_save_load(self):
+        classifier = self.classifier()
+        with TemporaryDirectory() as folder:
+            path = os.path.join(folder, "glyphs.npz")
+            classifier.save(path)
+            loaded = GlyphClassifier(k=3)
+            loaded.load(path)
+        imgs = [glyph(label, scale=0.95) for label in self.LABELS]
+        self.assertEqual(loaded.labels, classifier.labels)
+        self.assertEqual(loaded.classify(imgs), classifier.classify(imgs))
+
+    def test_segment_last_word(self):
+        line = np.full((40, 300), 255, np.uint8)
+        cv2.putText(line, "No. AB01", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+        cv2.rectangle(line, (0, 0), (299, 39), 0, 1)
+        crops = segment_glyphs(line)
+        self.assertEqual(len(crops), 4)
+        self.assertEqual("".join(label for label, _ in self.classifier().classify(crops)), "AB01")
+
+
+class AnalyzerTestCase(SimpleTestCase):
+    analyzer = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # (!) the reader is never called: the tests don't recognize text
+        cls.analyzer = Analyzer(reader=object(), glyphs=GlyphClassifier())
+
+
+def answer_sheet(rows: int = 6, columns: int = 10, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    # thresholded sheet of checkboxes (crosses, strokes & empty) & stats of the boxes (inside of the borders)
+    rng = np.random.default_rng(seed)
+    img = np.full((60 + rows * 40, 60 + columns * 32), 255, np.uint8)
+    cv2.rectangle(img, (10, 10), (img.shape[1] - 10, img.shape[0] - 10), 0, 3)
+    boxes = []
+    for r, c in product(range(rows), range(columns)):
+        x, y = 30 + c * 32, 30 + r * 40
+        cv2.rectangle(img, (x, y), (x + 24, y + 24), 0, 2)
+        mark = rng.integers(3)
+        if mark == 1:
+            cv2.line(img, (x + 5, y + 5), (x + 19, y + 19), 0, 2)
+            cv2.line(img, (x + 19, y + 5), (x + 5, y + 19), 0, 2)
+        elif mark == 2:
+            cv2.line(img, (x + 8, y + 12), (x + 8 + int(rng.integers(1, 10)), y + 12), 0, 1)
+        boxes.append([x + 2, y + 2, 21, 21, 21 * 21])
+    return img, np.array(boxes, dtype=np.int32)
+
+
+class FillRatiosTests(AnalyzerTestCase):
+    def test_same_as_fill_ratio(self):
+        for seed, m in product(range(3), [0, 1]):
+            img, boxes = answer_sheet(seed=seed)
+            expected = [self.analyzer.fill_ratio(img, box, m) for box in boxes]
+            self.assertEqual(self.analyzer.fill_ratios(img, boxes, m).tolist(), expected)
+
+    def test_check_marks(self):
+        img, boxes = answer_sheet(seed=1)
+        marks = self.analyzer.check_marks(img, boxes)
+        self.assertEqual(marks.tolist(), [self.analyzer.check_mark(img, box) for box in boxes])
+        self.assertTrue(marks.any() and not marks.all())
+
+    def test_subset_of_boxes(self):
+        img, boxes = answer_sheet(seed=2)
+        subset = boxes[[3, 17, 42]]
+        self.assertEqual(
+            self.analyzer.fill_ratios(img, subset).tolist(), [self.analyzer.fill_ratio(img, box) for box in subset]
+        )
+        self.assertEqual(self.analyzer.fill_ratios(img, subset[:1]).shape, (1,))
+        self.assertEqual(self.analyzer.fill_ratios(img, np.empty((0, 5), dtype=np.int32)).shape, (0,))
+
+
+def stored_stats(skew: int = 0, seed: int = 0) -> dict:
+    # recognition results as stored next to the image ({alias}.json): stats of the components of the sheet
+    # 5 rows of answers (10 checkboxes) & the correction row, the 3rd row drifts down by <skew> px per box
+    rng = np.random.default_rng(seed)
+    stats = [[0, 0, 800, 600, 300000], [10, 10, 780, 580, 150000]]
+    for r in range(6):
+        y = 100 + r * 40 if r < 5 else 400
+        for c in range(10):
+            dy = c * skew if r == 2 else int(rng.integers(-1, 2))
+            stats.append([50 + c * 30, y + dy, 20 + int(rng.integers(-1, 2)), 20, 400])
+    # text boxes of the sheet (not checkboxes)
+    stats += [[50, 40, 300, 30, 9000], [400, 40, 120, 30, 3600]]
+    order = rng.permutation(len(stats) - 2) + 2
+    return {"unique_key": "AAA", "stats": stats[:2] + [stats[i] for i in order], "fields": None}
+
+
+class ClusterRowsTests(AnalyzerTestCase):
+    def rows(self, recognition: dict) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        stats = np.array(json.loads(json.dumps(recognition))["stats"], dtype=np.int32)
+        stats = self.analyzer.filter_checkboxes(stats)
+        tolerance = self.analyzer.row_tolerance(stats)
+        return self.analyzer.cluster_rows(stats, tolerance), legacy_rows(stats, tolerance)
+
+    def test_same_as_legacy(self):
+        for seed in range(5):
+            rows, expected = self.rows(stored_stats(seed=seed))
+            self.assertEqual(len(rows), 6)
+            self.assertEqual(len(rows), len(expected))
+            for row, row_expected in zip(rows, expected):
+                self.assertTrue(np.array_equal(row, row_expected))
+
+    def test_rows_are_sorted(self):
+        rows, _ = self.rows(stored_stats(seed=1))
+        self.assertEqual([len(row) for row in rows], [10] * 6)
+        self.assertTrue(all((np.diff(row[:, 0]) > 0).all() for row in rows))
+        self.assertTrue(all(a[:, 1].max() < b[:, 1].min() for a, b in zip(rows, rows[1:])))
+
+    def test_skewed_row(self):
+        # (!) intended difference: the row drifts by 9 px (> tolerance) in steps of 1 px
+        # the previous algorithm splits it by the distance to the min y left (& repeats the boxes on the borders of
+        # the pieces), single pass keeps it whole
+        rows, expected = self.rows(stored_stats(skew=1))
+        self.assertEqual([len(row) for row in rows], [10] * 6)
+        self.assertEqual(rows[2][:, 1].tolist(), list(range(180, 190)))
+        pieces = expected[2:-3]
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual({tuple(box) for piece in pieces for box in piece}, {tuple(box) for box in rows[2]})
+        for row, row_expected in zip(rows[:2] + rows[3:], expected[:2] + expected[-3:]):
+            self.assertTrue(np.array_equal(row, row_expected))
@@ -13,7 +13,10 @@ urlpatterns = [
     path("verification/capture/<str:prefix>", Capture.as_view(), name="capture"),
     path("verification/score/<str:prefix>/<str:unique_key>", Score.as_view(), name="score"),
     path("download_archive/<str:prefix>", download_archive, name="download_archive"),
+    path("pack_status/<int:job_id>", pack_status, name="pack_status"),
     path("verification/recognize", recognize, name="recognize"),
+    path("verification/ingest", ingest, name="ingest"),
+    path("verification/ingest_status/<int:job_id>", ingest_status, name="ingest_status"),
     path("verification/rename_alias", rename_alias, name="rename_alias"),
     path("create_scoring_report/<str:prefix>", create_scoring_report, name="create_scoring_report"),
     path("logout/", logout_user, name="logout"),
@@ -1,7 +1,6 @@
-import json
-import numpy as np
+import os
+import logging
 import cv2
-from io import BytesIO
 from uuid import uuid4
 from decouple import config
 from django.utils.translation import gettext_lazy as _
@@ -15,23 +14,25 @@ from django.template.loader import render_to_string
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.core.exceptions import ObjectDoesNotExist
-from reshuffle.settings import PROJECT_NAME, LANGUAGE_CODE
+from reshuffle.settings import PROJECT_NAME, LANGUAGE_CODE, INGEST_ROOT
 from main.forms import *
 from main.models import *
 from minio.error import S3Error
 from main.services.docs.minio_client import MinioClient
-from main.services.docs.factory import DocumentPackager, GeneratorJSON
-from main.services.ocr.analyzer import Analyzer
+from main.services.docs.factory import DocumentPackager
+from main.services.ocr.ingest import (
+    IMAGE_FORMAT, FOLDER_CAPTURED, analyzer, get_archive_keys, get_archive_variant, get_recognized_fields,
+    rename_recognition, process_work, is_readable
+)
+
+logger = logging.getLogger(__name__)
 
 # UTILS -------------------------------------------------------------------------------------------------------------- #
 PAGINATION_N = 10  # TODO: fix screen scroll for 1920x1080 size
 
-IMAGE_FORMAT = "png"
-FOLDER_CAPTURED = "captured"
 FOLDER_SCORED = "scored"
 
-minio_client = MinioClient()
-analyzer = Analyzer()
+minio_client = MinioClient.shared()
 
 
 class ObjectStorageListView(LoginRequiredMixin, ListView):
@@ -84,10 +85,10 @@ class VerificationChildTemplateView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         archive = ObjectStorageEntry.objects.get(prefix=kwargs["prefix"])
-        data = json.loads(minio_client.get_object_content(f"{kwargs['prefix']}/{GeneratorJSON.OUTPUT_JSON}"))
+        data = get_archive_keys(kwargs["prefix"])
         qs_verified = VerifiedWorkEntry.objects.filter(archive=archive)
-        uk_verified = qs_verified.values_list("unique_key", flat=True)
-        uk_unverified = [v["unique_key"] for v in data["variants"] if v["unique_key"] not in uk_verified]
+        uk_verified = set(qs_verified.values_list("unique_key", flat=True))
+        uk_unverified = [uk for uk in data.unique_keys() if uk not in uk_verified]
         context = super().get_context_data(**kwargs)
         context["project_name"] = PROJECT_NAME.upper()
         context["table_head"] = [
@@ -154,6 +155,7 @@ class Creation(ObjectStorageListView, FormView):
         context["subtitle"] = _("Create a set of entrance exams")
         context["datepicker_language"] = LANGUAGE_CODE
         context["avg_generate_time"] = config("AVG_GENERATE_TIME")
+        context["jobs"] = PackJob.objects.filter(user=self.request.user, status__in=[0, 1]).order_by("created")
         return context
 
     def get_form_kwargs(self):
@@ -170,12 +172,11 @@ class Creation(ObjectStorageListView, FormView):
         return kwargs
 
     def form_valid(self, form):
-        dp = DocumentPackager()
-        dp.pack(
-            user_id=self.request.user.id,
-            sbj_id=form.cleaned_data["subject"].id,
-            count=form.cleaned_data["amount"],
-            date=form.cleaned_data["date"].strftime("%d.%m.%Y")
+        PackJob.objects.create(
+            user=self.request.user,
+            subject=form.cleaned_data["subject"],
+            amount=form.cleaned_data["amount"],
+            date=form.cleaned_data["date"]
         )
         return redirect(reverse_lazy("download"))
 
@@ -189,6 +190,8 @@ class Download(ObjectStorageListView):
         context["title"] = _("Download") + " | " + PROJECT_NAME
         context["subtitle"] = _("Download a set of entrance exams")
         context["prefix_created"] = qs[0].prefix if qs else None
+        context["avg_generate_time"] = config("AVG_GENERATE_TIME")
+        context["jobs"] = PackJob.objects.filter(user=self.request.user, status__in=[0, 1]).order_by("created")
         return context
 
 
@@ -241,17 +244,15 @@ class Score(VerificationChildTemplateView, FormView):
 
     def get(self, request, *args, **kwargs):
         try:
-            data = json.loads(minio_client.get_object_content(f"{kwargs['prefix']}/{GeneratorJSON.OUTPUT_JSON}"))
-            for v in data["variants"]:
-                if kwargs["unique_key"] == v["unique_key"]:
-                    try:
-                        minio_client.get_object_stats(
-                            alias=f"{kwargs['prefix']}/{FOLDER_CAPTURED}/{kwargs['unique_key']}.{IMAGE_FORMAT}"
-                        )
-                    except S3Error:
-                        messages.error(request, _("The requested image was not found"))
-                        return redirect(reverse_lazy("capture", kwargs={"prefix": kwargs["prefix"]}))
-                    return super().get(request, *args, **kwargs)
+            if kwargs["unique_key"] in get_archive_keys(kwargs["prefix"]):
+                try:
+                    minio_client.get_object_stats(
+                        alias=f"{kwargs['prefix']}/{FOLDER_CAPTURED}/{kwargs['unique_key']}.{IMAGE_FORMAT}"
+                    )
+                except S3Error:
+                    messages.error(request, _("The requested image was not found"))
+                    return redirect(reverse_lazy("capture", kwargs={"prefix": kwargs["prefix"]}))
+                return super().get(request, *args, **kwargs)
             messages.error(
                 request,
                 _("The specified unique key is invalid") + f": <b class='uk'>{kwargs['unique_key']}</b>"
@@ -263,17 +264,22 @@ class Score(VerificationChildTemplateView, FormView):
 
     def get_context_data(self, **kwargs):
         alias = f"{kwargs['prefix']}/{FOLDER_CAPTURED}/{kwargs['unique_key']}.{IMAGE_FORMAT}"
-        img_data = minio_client.get_object_content(alias=alias, decoded=False).data
-        img_threshold = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_GRAYSCALE)
-        variants = json.loads(
-            minio_client.get_object_content(f"{kwargs['prefix']}/{GeneratorJSON.OUTPUT_JSON}")
-        )["variants"]
-        variant = list(filter(lambda v: v["unique_key"] == kwargs["unique_key"], variants))[0]
+        variant = get_archive_variant(kwargs["prefix"], kwargs["unique_key"])
+        score_result = None
         try:
-            stats = analyzer.calc_stats(img_threshold)
-            f_answers, f_correction = analyzer.get_fields(img_threshold, stats, variant)
-            score_result = analyzer.score(variant, f_answers, f_correction)
-        except:
+            # (!) recognition results are stored on upload, so no OCR is done here (None: the work is not recognized)
+            fields = get_recognized_fields(alias, kwargs["unique_key"], variant)
+        except S3Error as e:
+            logger.warning(f"Recognition results of {alias} cannot be loaded: {e}")
+            fields = None
+        if fields is not None:
+            try:
+                score_result = analyzer.score(variant, *fields)
+            except (KeyError, IndexError, ValueError, TypeError) as e:
+                # recognized fields don't match the variant (e.g. the sheet is damaged)
+                logger.warning(f"Work {alias} cannot be scored: {type(e).__name__}: {e}")
+        if score_result is None:
+            # the work is scored manually
             variant["total_score"] = sum([p["info"]["task_count"] for p in variant["parts"]])
             variant["achieved_score"] = 0
             score_result = {"scored": False, "variant": variant}
@@ -309,6 +315,10 @@ class Score(VerificationChildTemplateView, FormView):
             alias_old=f"{prefix}/{FOLDER_CAPTURED}/{unique_key}.{IMAGE_FORMAT}",
             alias_new=f"{prefix}/{FOLDER_SCORED}/{unique_key}.{IMAGE_FORMAT}"
         )
+        rename_recognition(
+            alias_old=f"{prefix}/{FOLDER_CAPTURED}/{unique_key}.{IMAGE_FORMAT}",
+            alias_new=f"{prefix}/{FOLDER_SCORED}/{unique_key}.{IMAGE_FORMAT}"
+        )
         messages.success(
             self.request,
             _("The work is scored") + f": <b class='uk'>{unique_key}</b> <b>({score})</b>"
@@ -326,6 +336,17 @@ def download_archive(request, prefix: str = None):
     return JsonResponse({"error": "you don't have enough permissions"})
 
 
+def pack_status(request, job_id: int = None):
+    if request.method == "GET":
+        if request.user.is_authenticated:
+            job = PackJob.objects.filter(id=job_id, user=request.user).first()
+            if job:
+                # generate JSON response (correct)
+                return JsonResponse(job.to_dict())
+    # generate JSON response (error)
+    return JsonResponse({"error": "you don't have enough permissions"})
+
+
 def recognize(request):
     if request.method == "POST":
         if request.user.is_authenticated:
@@ -334,25 +355,8 @@ def recognize(request):
             img_path = request.FILES.get("image").temporary_file_path()
             # recognize the unique key of the uploaded work
             try:
-                # process image
-                img_base = cv2.imread(img_path)
-                img_grayscale = analyzer.grayscale(img_base)
-                img_restore_perspective = analyzer.restore_perspective(img_grayscale)
-                img_threshold = analyzer.threshold(img_restore_perspective)
-                stats = analyzer.calc_stats(img_threshold)
-                data = json.loads(minio_client.get_object_content(f"{prefix}/{GeneratorJSON.OUTPUT_JSON}"))
-                uk = analyzer.get_unique_key(img_threshold, stats, data)
-                # save processed image to storage
-                _, buffer = cv2.imencode(f".{IMAGE_FORMAT}", img_threshold)
-                obj = BytesIO(buffer.tobytes())
-                name = uk if uk else str(uuid4())
-                minio_client.upload_bytes(
-                    obj=obj,
-                    alias=f"{prefix}/{FOLDER_CAPTURED}/{name}.{IMAGE_FORMAT}",
-                    length=obj.getbuffer().nbytes
-                )
-                # generate JSON response (recognized)
-                return JsonResponse({"recognized": True, "unique_key": uk, "alias": name})
+                # generate JSON response (recognized or not)
+                return JsonResponse(process_work(cv2.imread(img_path), prefix))
             except:
                 # generate JSON response (unrecognized)
                 return JsonResponse({"recognized": False, "unique_key": None, "alias": None})
@@ -360,6 +364,42 @@ def recognize(request):
     return JsonResponse({"error": "you don't have enough permissions"})
 
 
+def ingest(request):
+    if request.method == "POST":
+        if request.user.is_authenticated:
+            # get data from request (ZIP archive of images or multi-page PDF)
+            prefix = request.POST.get("prefix") if request.POST.get("prefix") else ""
+            file = request.FILES.get("file")
+            if file is None:
+                # generate JSON response (error)
+                return JsonResponse({"error": "no file is uploaded"})
+            if not is_readable(file):
+                # generate JSON response (error)
+                return JsonResponse({"error": "only ZIP archives are accepted: PyMuPDF is not installed (PDF files)"})
+            # the batch is processed by the ingest worker (see run_ingest_worker), the client polls its status
+            os.makedirs(INGEST_ROOT, exist_ok=True)
+            path = os.path.join(INGEST_ROOT, f"{uuid4()}{os.path.splitext(file.name)[1].lower()}")
+            with open(path, "wb") as f:
+                for chunk in file.chunks():
+                    f.write(chunk)
+            job = IngestJob.objects.create(user=request.user, prefix=prefix, path=path)
+            # generate JSON response (queued)
+            return JsonResponse(job.to_dict() | {"url": str(reverse_lazy("ingest_status", kwargs={"job_id": job.id}))})
+    # generate JSON response (error)
+    return JsonResponse({"error": "you don't have enough permissions"})
+
+
+def ingest_status(request, job_id: int = None):
+    if request.method == "GET":
+        if request.user.is_authenticated:
+            job = IngestJob.objects.filter(id=job_id, user=request.user).first()
+            if job:
+                # generate JSON response (correct)
+                return JsonResponse(job.to_dict())
+    # generate JSON response (error)
+    return JsonResponse({"error": "you don't have enough permissions"})
+
+
 def rename_alias(request):
     if request.method == "POST":
         if request.user.is_authenticated:
@@ -372,6 +412,10 @@ def rename_alias(request):
                     alias_old=f"{prefix}/{FOLDER_CAPTURED}/{alias_old}.{IMAGE_FORMAT}",
                     alias_new=f"{prefix}/{FOLDER_CAPTURED}/{alias_new}.{IMAGE_FORMAT}"
                 )
+                rename_recognition(
+                    alias_old=f"{prefix}/{FOLDER_CAPTURED}/{alias_old}.{IMAGE_FORMAT}",
+                    alias_new=f"{prefix}/{FOLDER_CAPTURED}/{alias_new}.{IMAGE_FORMAT}"
+                )
                 # generate JSON response (correct)
                 return JsonResponse({"alias": alias_new})
             except:
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from decouple import config, Csv
 from django.contrib.messages import constants as messages
@@ -157,6 +158,61 @@ MINIO_ACCESS_KEY = config("MINIO_ACCESS_KEY")
 MINIO_SECRET_KEY = config("MINIO_SECRET_KEY")
 MINIO_BUCKET_NAME = config("MINIO_BUCKET_NAME")
 
+MINIO_POOL_SIZE = config("MINIO_POOL_SIZE", default=16, cast=int)  # kept-alive connections of the process
+MINIO_TIMEOUT = config("MINIO_TIMEOUT", default=300, cast=int)  # connect & read timeout (seconds)
+
+ARCHIVE_CACHE_SIZE = config("ARCHIVE_CACHE_SIZE", default=256 * 1024 * 1024, cast=int)  # parsed data.json (bytes)
+UPLOAD_WORKERS = config("UPLOAD_WORKERS", default=8, cast=int)  # concurrent uploads of multiple objects
+UPLOAD_RETRIES = config("UPLOAD_RETRIES", default=3, cast=int)  # retries of a failed upload (exponential backoff)
+
+# Documents generation
+
+GENERATE_WORKERS = config("GENERATE_WORKERS", default=os.cpu_count(), cast=int)
+GENERATE_PARALLEL_THRESHOLD = config("GENERATE_PARALLEL_THRESHOLD", default=200, cast=int)
+XLSX_STREAMING = config("XLSX_STREAMING", default=True, cast=bool)  # False: copy the sample sheet in memory
+DOCS_LAYOUT = config("DOCS_LAYOUT", default="single")  # "split": tasks & answers of every variant in separate files
+
+# Background jobs (archives & batches of scans)
+
+JOB_HEARTBEAT = config("JOB_HEARTBEAT", default=30, cast=int)  # running jobs are touched by their worker every N s
+JOB_STALE_TIMEOUT = config("JOB_STALE_TIMEOUT", default=300, cast=int)  # running jobs without heartbeat fail
+
+# Verification
+
+INGEST_WORKERS = config("INGEST_WORKERS", default=4, cast=int)  # pages of a batch of scans processed at once
+INGEST_ROOT = config("INGEST_ROOT", default=str(Path(MEDIA_ROOT, "ingest")))  # uploaded batches waiting for the worker
+OCR_SOCKET = config("OCR_SOCKET", default="")  # Unix socket of the shared OCR service (empty: models of every process)
+OCR_BATCH_SIZE = config("OCR_BATCH_SIZE", default=16, cast=int)  # max images (not requests) of one batch of the service
+OCR_BATCH_WAIT = config("OCR_BATCH_WAIT", default=0.01, cast=float)  # time to wait for more images of the batch (s)
+GLYPH_MODEL = config("GLYPH_MODEL", default=str(Path(MEDIA_ROOT, "ocr", "glyphs.npz")))  # glyph classifier samples
+GLYPH_NEIGHBOURS = config("GLYPH_NEIGHBOURS", default=5, cast=int)  # samples voting for the label of a glyph
+GLYPH_MIN_CONFIDENCE = config("GLYPH_MIN_CONFIDENCE", default=0.8, cast=float)  # below: field is read by EasyOCR
+
+# Logging
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {
+            "format": "[{asctime}] {levelname} {name}: {message}",
+            "style": "{",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "simple",
+        },
+    },
+    "loggers": {
+        "main": {
+            "handlers": ["console"],
+            "level": config("LOG_LEVEL", default="INFO"),
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 